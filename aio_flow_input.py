@@ -0,0 +1,160 @@
+import json
+import zlib
+import random
+import asyncio
+import aio_pika
+from .flow_input import FlowInput, WINDOW_SIZE
+
+
+CHANNEL_POOL_SIZE = 4
+MAX_INFLIGHT = 1000
+
+
+class AsyncFlowInput(object):
+    """asyncio version of FlowInput
+
+    Meant to be shared by all the coroutines of a process: one robust
+    connection, a pool of channels in publisher confirm mode used round
+    robin. A publish only waits for its own confirm, so up to max_inflight
+    tasks are on the wire at once instead of one per round trip.
+    task_conf and rabbitmq_conf are loaded by FlowInput.load_conf.
+    """
+
+    def __init__(self, pool_size=CHANNEL_POOL_SIZE, max_inflight=MAX_INFLIGHT, loop=None):
+        self._loop = loop
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        self._pool_size = pool_size
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._lock = asyncio.Lock()
+        self._connection = None
+        self._channel_ls = []
+        self._index = 0
+
+    async def connect(self):
+        async with self._lock:
+            if self._connection is not None:
+                return
+            await self._loop.run_in_executor(None, FlowInput.load_conf)
+            self.task_conf_dct = FlowInput.task_conf_dct
+            rabbitmq_conf_dct = FlowInput.rabbitmq_conf_dct
+            addr = random.choice(rabbitmq_conf_dct['addr'])
+            self._connection = await aio_pika.connect_robust(
+                    host=addr['ip'], port=addr['port'], virtualhost="/",
+                    login=rabbitmq_conf_dct['authc']['account'],
+                    password=rabbitmq_conf_dct['authc']['password'])
+            self._channel_ls = [await self._connection.channel() for _ in range(self._pool_size)]
+
+    async def close(self):
+        async with self._lock:
+            if self._connection is not None:
+                await self._connection.close()
+                self._connection = None
+                self._channel_ls = []
+
+    async def _publish(self, routing_key, body):
+        """Publish on the next channel of the pool, return whether it is confirmed
+        """
+        index = self._index
+        self._index = (self._index + 1) % self._pool_size
+        channel = self._channel_ls[index]
+        async with self._inflight:
+            try:
+                return bool(await channel.default_exchange.publish(aio_pika.Message(body),
+                                                                   routing_key=routing_key))
+            except Exception:
+                print("[flow input]=====publish error=====")
+                if self._channel_ls[index] is channel:
+                    try:
+                        self._channel_ls[index] = await self._connection.channel()
+                    except Exception:
+                        print("[flow input]=====reopen channel error=====")
+                return False
+
+    async def _send_statistic(self, task_type, count):
+        statistic_dct = {
+            "tid": 'stats',
+            "i": 0,
+            "data": {
+                'extra': {
+                    'stats': {
+                        'tid': task_type,
+                        'step': 0,
+                        'count': count
+                    }
+                }
+            }
+        }
+        await self._publish('statistic:input', zlib.compress(json.dumps(statistic_dct).encode('utf-8')))
+
+    def _get_queue_name(self, task_type):
+        assert task_type in self.task_conf_dct, "task_type isn't supported"
+        return self.task_conf_dct[task_type][0]['name']
+
+    def _encode(self, task_type, task_data):
+        assert isinstance(task_data, dict), "task_data isn't a dictionary"
+        task_dct = {
+            "tid": task_type,
+            "i": 0,
+            "data": task_data
+        }
+        return zlib.compress(json.dumps(task_dct).encode('utf-8'))
+
+    async def send_task(self, task_type, task_data):
+        """Send task data
+
+        Success:
+            return True
+        Failure:
+            return False
+        """
+        await self.connect()
+        queue_name = self._get_queue_name(task_type)
+        body = self._encode(task_type, task_data)
+        res = False
+        retry = 3
+        while retry > 0 and not res:
+            retry -= 1
+            res = await self._publish(queue_name, body)
+        if res:
+            await self._send_statistic(task_type, 1)
+        return res
+
+    async def send_tasks(self, task_type, task_data_iter, window_size=WINDOW_SIZE):
+        """Send a stream of task data
+
+        Tasks of a window are published concurrently, those not confirmed
+        are published again, then one statistic message counts the window.
+
+        return the number of tasks confirmed, it stops after a window which
+        still has unconfirmed tasks, so on failure the tail of
+        task_data_iter isn't sent
+        """
+        await self.connect()
+        queue_name = self._get_queue_name(task_type)
+        count = 0
+        body_ls = []
+        for task_data in task_data_iter:
+            body_ls.append(self._encode(task_type, task_data))
+            if len(body_ls) >= window_size:
+                sent, ok = await self._send_window(task_type, queue_name, body_ls)
+                count += sent
+                if not ok:
+                    return count
+                body_ls = []
+        if body_ls:
+            sent, _ = await self._send_window(task_type, queue_name, body_ls)
+            count += sent
+        return count
+
+    async def _send_window(self, task_type, queue_name, body_ls):
+        sent = 0
+        retry = 3
+        while retry > 0 and body_ls:
+            retry -= 1
+            ret_ls = await asyncio.gather(*[self._publish(queue_name, body) for body in body_ls])
+            sent += sum(ret_ls)
+            body_ls = [body for body, ret in zip(body_ls, ret_ls) if not ret]
+        if sent:
+            await self._send_statistic(task_type, sent)
+        return sent, not body_ls
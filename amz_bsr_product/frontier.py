@@ -0,0 +1,131 @@
+import time
+import itertools
+from util.packed_set import PackedSet, PackedMap, pack_asin, to_asin
+
+
+class BSRRun(object):
+    """State of one best seller crawl, from its root url to its last page
+
+    pending counts the pages enqueued or being crawled, the run is complete
+    when it drops to 0. The visited categories and the asins already sent
+    belong to the run, so runs of several roots or platforms don't mix.
+    A full run starts from the root and collects the category tree in
+    node_map, other runs start from the leaves of the saved tree.
+    The categories of each asin are gathered until the crawl is over, then
+    the asins are flushed in chunks, one product task per asin.
+    """
+    def __init__(self, run_id, platform, root_url, cate_filter, date, with_qty=False):
+        self.run_id = run_id
+        self.scope = None
+        self.full = True
+        self.platform = platform
+        self.root_url = root_url
+        self.cate_filter = [cate.lower() for cate in cate_filter]
+        self.date = date
+        self.with_qty = with_qty
+        self.pending = 0
+        self.page_count = 0
+        self.crawled = False
+        # packed, a run of a big marketplace meets millions of asins:
+        # asin -> index of its first category in cate_ls, the other
+        # categories of the few asins in several ones are in more_cate_map
+        self.category_id_set = PackedSet()
+        self.asin_map = PackedMap()
+        self.more_cate_map = {}
+        self.other_asin_map = {}
+        self.cate_ls = []
+        self.cate_index_map = {}
+        self.node_map = {}
+        self.abandon_count = 0
+        self.tree_stale = False
+        self.start_time = time.time()
+
+    def claim_category(self, cate_id):
+        """Mark a category visited, return whether it already was
+
+        A category reached by several parents is only expanded once. Claim it
+        before the page is parsed, so concurrent workers don't both expand it.
+        """
+        if cate_id is None:
+            return False
+        if cate_id in self.category_id_set:
+            return True
+        self.category_id_set.add(cate_id)
+        return False
+
+    def release_category(self, cate_id):
+        """Give up a claim when the page turned out not to be a bsr page"""
+        self.category_id_set.discard(cate_id)
+
+    def add_node(self, key, url, parent_key, is_leaf, page_url_ls):
+        if self.full:
+            self.node_map[key] = (url, parent_key, is_leaf, page_url_ls)
+
+    def add_asins(self, asin_ls):
+        """Gather the category of each asin of a page"""
+        for item in asin_ls:
+            index = self.cate_index_map.get(item['cate'])
+            if index is None:
+                index = len(self.cate_ls)
+                self.cate_ls.append(item['cate'])
+                self.cate_index_map[item['cate']] = index
+            value = pack_asin(item['asin'])
+            if value is None:
+                index_ls = self.other_asin_map.setdefault(item['asin'], [])
+                if index not in index_ls:
+                    index_ls.append(index)
+                continue
+            first = self.asin_map.get(value)
+            if first is None:
+                self.asin_map[value] = index
+            elif first != index:
+                index_ls = self.more_cate_map.setdefault(value, [])
+                if index not in index_ls:
+                    index_ls.append(index)
+
+    def asin_count(self):
+        return len(self.asin_map) + len(self.other_asin_map)
+
+    def slot_count(self):
+        return self.asin_map.slot_count()
+
+    def slot_asins(self, start, stop):
+        """(asin, categories) of the asins in the slots [start, stop) of asin_map,
+        the chunk reaching the end of the map also gets the asins which don't pack
+        """
+        for value, index in self.asin_map.slot_items(start, stop):
+            index_ls = [index] + self.more_cate_map.get(value, [])
+            yield to_asin(value), [self.cate_ls[i] for i in index_ls]
+        if stop >= self.asin_map.slot_count():
+            for asin, index_ls in self.other_asin_map.items():
+                yield asin, [self.cate_ls[i] for i in index_ls]
+
+
+class BSRFrontier(object):
+    """Running bsr crawls of a process, by run id"""
+    def __init__(self):
+        self._run_id = itertools.count(1)
+        self._run_map = {}
+
+    def __len__(self):
+        return len(self._run_map)
+
+    def start(self, platform, root_url, cate_filter, date, with_qty=False):
+        run = BSRRun(next(self._run_id), platform, root_url, cate_filter, date, with_qty)
+        run.pending = 1
+        self._run_map[run.run_id] = run
+        return run
+
+    def get(self, run_id):
+        return self._run_map.get(run_id)
+
+    def page_done(self, run, new_page_cnt):
+        """Account a crawled page which enqueued new_page_cnt pages, a retried page
+        counts as one new page. Return True when no page is left.
+        """
+        run.pending += new_page_cnt - 1
+        run.page_count += 1
+        return run.pending <= 0
+
+    def finish(self, run):
+        del self._run_map[run.run_id]
@@ -7,21 +7,141 @@ from lxml import etree
 from error import RequestError, CaptchaError, BannedError
 from util.log import logger
 from util.prrequest import GetPageSession
-from .spiders.dispatch import get_spider_by_platform
+from .spiders.dispatch import get_spider_by_platform, PLATFORM_MAP
+from .frontier import BSRFrontier
+from .tree import CategoryTree
 from util.task_protocal import TaskProtocal
+from util.parse_executor import ParseExecutor
 from pipeflow import RabbitmqInputEndpoint, RabbitmqOutputEndpoint
-from config import RABBITMQ_CONF
+from config import RABBITMQ_CONF, BSR_TREE_PATH
 
 
-MAX_WORKERS = 1
-PLATFORM_FILTER_LS = ["amazon_us"]
+MAX_WORKERS = 30
+# parse pages in a pool of processes, 0 means parse on the event loop
+PARSE_WORKERS = 0
+# root tasks crawled at the same time
+MAX_RUNS = 4
+PLATFORM_FILTER_LS = list(PLATFORM_MAP)
+# walk a root's whole category tree again after this, else only its leaves
+TREE_RECHECK_INTERVAL = 7*24*3600
+# asin map slots sent by a flush task, at most 3/4 of them hold an asin
+FLUSH_SLOTS = 2048
 
 
-filter_ls = []
-task_start = False
-task_count = 0
-category_id_set = set([])
-asin_set = set([])
+frontier = BSRFrontier()
+category_tree = CategoryTree(BSR_TREE_PATH)
+input_suspended = False
+parse_executor = ParseExecutor([__name__])
+
+
+def parse_page(platform, html, cate_filter, is_exist):
+    """Extract sub category urls and asins from page html, None if it isn't a bsr page
+
+    Run by parse_executor, so it only takes and returns picklable objects.
+    """
+    soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
+    handle = get_spider_by_platform(platform)(soup)
+    if not handle.is_bsr_page():
+        return None
+    url_ls, asin_ls = handle.get_info(cate_filter, is_exist)
+    return url_ls, list(asin_ls), handle.is_leaf()
+
+
+async def crawl_page(tp, task_dct, run):
+    """Crawl one page of a run, return the tasks it makes
+    """
+    url = task_dct['url']
+    logger.info("[%d] %s" % (run.run_id, url))
+    with GetPageSession() as sess:
+        try:
+            #sess = GetPageSession()
+            html = await sess.get_page('get', url, timeout=60, captcha_bypass=True)
+        except BannedError as exc:
+            # retry the page here, input only takes root tasks
+            tp.set_to('inner_output')
+            ban_tp = tp.new_task({'proxy': exc.proxy[7:]})
+            ban_tp.set_to('ban')
+            return [ban_tp, tp]
+        except RequestError:
+            tp.set_to('inner_output')
+            return [tp]
+        except CaptchaError:
+            tp.set_to('inner_output')
+            return [tp]
+        except Exception as exc:
+            exc_info = (type(exc), exc, exc.__traceback__)
+            taks_info = ' '.join([task_dct['platform'], url])
+            logger.error('Get page handle error\n'+taks_info, exc_info=exc_info)
+            exc.__traceback__ = None
+            run.abandon_count += 1
+            return []
+
+    cate_id = None
+    reg = re.search(r'/(\d+)/ref=', url)
+    if reg:
+        cate_id = int(reg.group(1))
+    # pagination pages and the leaves of a saved tree are never expanded
+    is_leaf_task = task_dct.get('leaf', False)
+    is_exist = True if is_leaf_task else run.claim_category(cate_id)
+    try:
+        page = await parse_executor.run(parse_page, task_dct['platform'], html, run.cate_filter, is_exist)
+    except Exception as exc:
+        exc_info = (type(exc), exc, exc.__traceback__)
+        taks_info = ' '.join([task_dct['platform'], url])
+        logger.error('Get page info error\n'+taks_info, exc_info=exc_info)
+        exc.__traceback__ = None
+        page = None
+    # abandon result
+    if page is None:
+        if not is_exist:
+            run.release_category(cate_id)
+        run.abandon_count += 1
+        return []
+    url_ls, asin_ls, is_leaf = page
+    run.add_asins(asin_ls)
+    if is_leaf_task and not is_leaf:
+        logger.info("[%d] %s got sub categories" % (run.run_id, url))
+        run.tree_stale = True
+    cate_key = str(cate_id) if cate_id is not None else url
+    if not is_exist:
+        run.add_node(cate_key, url, task_dct.get('parent'), is_leaf, url_ls if is_leaf else [])
+
+    task_ls = []
+    for url in url_ls:
+        dct = {'platform': task_dct['platform'], 'url': url,
+               'date': task_dct['date'], 'run': run.run_id,
+               'with_qty': task_dct.get('with_qty', False)}
+        if is_leaf:
+            dct['leaf'] = True
+        else:
+            dct['parent'] = cate_key
+        new_tp = tp.new_task(dct)
+        new_tp.set_to('inner_output')
+        task_ls.append(new_tp)
+    return task_ls
+
+
+def flush_asins(tp, task_dct, run):
+    """Send the product tasks of a chunk of the run's asins, and the next flush task
+    """
+    start = task_dct['flush']
+    stop = start + FLUSH_SLOTS
+    task_ls = []
+    for asin, cate_ls in run.slot_asins(start, stop):
+        new_tp = tp.new_task({'platform': run.platform,
+                              'asin': asin,
+                              'with_qty': run.with_qty,
+                              'extra': {
+                                  'bsr': {'bs_cate': cate_ls, 'date': run.date}
+                                  }
+                              })
+        new_tp.set_to('output')
+        task_ls.append(new_tp)
+    if stop < run.slot_count():
+        new_tp = tp.new_task({'platform': run.platform, 'run': run.run_id, 'flush': stop})
+        new_tp.set_to('inner_output')
+        task_ls.append(new_tp)
+    return task_ls
 
 
 async def handle_worker(group, task):
@@ -32,9 +152,18 @@ async def handle_worker(group, task):
             {
                 "platform": "amazon_us",
                 "url": "https://www.amazon.de/gp/bestsellers",
-                "date": "2017-08-08"
+                "date": "2017-08-08",
+                "run": 1,
+                "parent": "category id",    #optional
+                "leaf": True,   #optional, leaf or pagination page
                 "with_qty": True    #optional
             }
+        once the pages are crawled:
+            {
+                "platform": "amazon_us",
+                "run": 1,
+                "flush": 0      # first slot of the asins to send
+            }
     [output] result data format:
         JSON:
             {
@@ -43,100 +172,46 @@ async def handle_worker(group, task):
                 "with_qty": True    #optional
                 "extra": {
                     "bsr": {
-                        "bs_cate": [item["cate"]],
+                        "bs_cate": ["cate1", ... ,"catex"],
                         "date": "xxxx-xx-xx"
                     }
                 }
             }
     """
-    global filter_ls
-    global task_count
-    global category_id_set
-    global asin_set
-
     tp = TaskProtocal(task)
     task_dct = tp.get_data()
+    run = frontier.get(task_dct['run'])
+    if run is None:
+        return
+    task_ls = []
     try:
-        task_count -= 1
-        handle_cls = get_spider_by_platform(task_dct['platform'])
-        url = task_dct['url']
-        logger.info("%s" % (url,))
-        with GetPageSession() as sess:
-            try:
-                #sess = GetPageSession()
-                html = await sess.get_page('get', url, timeout=60, captcha_bypass=True)
-                soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
-                handle = handle_cls(soup)
-            except BannedError as exc:
-                tp.set_to('input_back')
-                ban_tp = tp.new_task({'proxy': exc.proxy[7:]})
-                ban_tp.set_to('ban')
-                return [ban_tp, tp]
-            except RequestError:
-                tp.set_to('inner_output')
-                task_count += 1
-                return tp
-            except CaptchaError:
-                tp.set_to('inner_output')
-                task_count += 1
-                return tp
-            except Exception as exc:
-                exc_info = (type(exc), exc, exc.__traceback__)
-                taks_info = ' '.join([task_dct['platform'], url])
-                logger.error('Get page handle error\n'+taks_info, exc_info=exc_info)
-                exc.__traceback__ = None
-                return
-
-        is_bsr_page = handle.is_bsr_page()
-        # abandon result
-        if not is_bsr_page:
-            return
-
-        is_exist = False
-        reg = re.search(r'/(\d+)/ref=', url)
-        if reg:
-            cate_id = int(reg.group(1))
-            if cate_id not in category_id_set:
-                category_id_set.add(cate_id)
-            else:
-                is_exist = True
-        try:
-            url_ls, asin_ls = handle.get_info(filter_ls, is_exist)
-        except Exception as exc:
-            exc_info = (type(exc), exc, exc.__traceback__)
-            taks_info = ' '.join([task_dct['platform'], url])
-            logger.error('Get page info error\n'+taks_info, exc_info=exc_info)
-            exc.__traceback__ = None
-            return
-        asin_ls = [item for item in asin_ls if item['asin'] not in asin_set]
-        asin_set.update([item['asin'] for item in asin_ls])
-
-        task_ls = []
-        for url in url_ls:
-            new_tp = tp.new_task({'platform': task_dct['platform'], 'url': url,
-                                  'date': task_dct['date'],
-                                  'with_qty': task_dct.get('with_qty', False)})
-            new_tp.set_to('inner_output')
-            task_ls.append(new_tp)
-        task_count += len(url_ls)
-        for item in asin_ls:
-            new_tp = tp.new_task({'platform': task_dct['platform'],
-                                  'asin': item['asin'],
-                                  'with_qty': task_dct.get('with_qty', False),
-                                  'extra': {
-                                      'bsr': {'bs_cate': [item['cate']], 'date': task_dct['date']}
-                                      }
-                                  })
-            new_tp.set_to('output')
-            task_ls.append(new_tp)
-        return task_ls
+        if 'flush' in task_dct:
+            task_ls = flush_asins(tp, task_dct, run)
+        else:
+            task_ls = await crawl_page(tp, task_dct, run)
     finally:
-        if group.get_running_cnt() == 1 and task_count == 0:
-            category_id_set = set([])
-            asin_set = set([])
-            new_task = pipeflow.Task(b'task done')
-            new_task.set_to('notify')
-            return new_task
+        new_page_cnt = len([t for t in task_ls if t.get_to() == 'inner_output'])
+        if frontier.page_done(run, new_page_cnt):
+            if not run.crawled:
+                run.crawled = True
+                logger.info("[%d] %s crawled, %d pages, %d asins, %.0fs" % (
+                    run.run_id, run.root_url, run.page_count, run.asin_count(),
+                    time.time()-run.start_time))
+                if run.full:
+                    category_tree.save(run.scope, run.node_map, not run.abandon_count)
+                elif run.tree_stale:
+                    category_tree.expire(run.scope)
+                # every category of every asin is known now, send them
+                flush_tp = tp.new_task({'platform': run.platform, 'run': run.run_id, 'flush': 0})
+                flush_tp.set_to('inner_output')
+                task_ls.append(flush_tp)
+                run.pending += 1
+            else:
+                frontier.finish(run)
+                notify_task = pipeflow.Task(b'task done')
+                notify_task.set_to('notify')
+                task_ls.append(notify_task)
+    return task_ls
 
 
 async def handle_task(group, task):
@@ -154,9 +229,7 @@ async def handle_task(group, task):
         BYTES:
             b"task done"
     """
-    global filter_ls
-    global task_start
-    global task_count
+    global input_suspended
 
     from_name = task.get_from()
     if from_name == 'input':
@@ -164,31 +237,53 @@ async def handle_task(group, task):
         task_dct = tp.get_data()
         if task_dct['platform'] not in PLATFORM_FILTER_LS:
             return
-        if task_start:
+        if len(frontier) >= MAX_RUNS:
             tp.set_to('input_back')
             return tp
-        else:
+        run = frontier.start(task_dct['platform'], task_dct['root_url'],
+                             task_dct['category_filter'],
+                             time.strftime("%Y-%m-%d", time.localtime()),
+                             task_dct.get('with_qty', False))
+        if len(frontier) >= MAX_RUNS:
             group.suspend_endpoint('input')
-            task_start = True
-            logger.info(task_dct['root_url'])
-            filter_ls = [cate.lower() for cate in task_dct['category_filter']]
+            input_suspended = True
+        run.scope = category_tree.get_scope(run.root_url, run.cate_filter)
+        leaf_ls = category_tree.load_leaves(run.scope, TREE_RECHECK_INTERVAL)
+        if leaf_ls is None:
+            logger.info("[%d] %s" % (run.run_id, run.root_url))
             task_dct['url'] = task_dct['root_url']
-            task_dct['date'] = time.strftime("%Y-%m-%d", time.localtime())
+            task_dct['date'] = run.date
+            task_dct['run'] = run.run_id
             del task_dct['root_url']
             del task_dct['category_filter']
             new_tp = tp.new_task(task_dct)
             new_tp.set_to('inner_output')
-            task_count = 1
             return new_tp
 
-    if from_name == 'notify' and task_start:
+        run.full = False
+        task_ls = []
+        for url, page_url_ls in leaf_ls:
+            for page_url in [url] + page_url_ls:
+                new_tp = tp.new_task({'platform': run.platform, 'url': page_url,
+                                      'date': run.date, 'run': run.run_id, 'leaf': True,
+                                      'with_qty': run.with_qty})
+                new_tp.set_to('inner_output')
+                task_ls.append(new_tp)
+        # one pending page per leaf page instead of the root
+        run.pending = len(task_ls)
+        logger.info("[%d] %s from %d leaves, %d pages" % (run.run_id, run.root_url,
+                                                          len(leaf_ls), len(task_ls)))
+        return task_ls
+
+    if from_name == 'notify':
         if task.get_data() == b'task done':
-            filter_ls = []
-            task_start = False
-            group.resume_endpoint('input')
+            if input_suspended and len(frontier) < MAX_RUNS:
+                group.resume_endpoint('input')
+                input_suspended = False
 
 
 def run():
+    parse_executor.start(PARSE_WORKERS)
     bsr_end = RabbitmqInputEndpoint('amz_bsr:input', **RABBITMQ_CONF)
     output_end = RabbitmqOutputEndpoint(['amz_bsr:input', 'amz_bsr:output',
                                          'amz_ip_ban:input'], **RABBITMQ_CONF)
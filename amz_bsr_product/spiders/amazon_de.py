@@ -17,6 +17,13 @@ class AMZDEBSRCategoryInfo(object):
             return True
         return False
 
+    def is_leaf(self):
+        """Determinate the category has no sub category or not
+        """
+        root = self.soup.xpath("//ul[@id='zg_browseRoot']")
+        selected = root[0].xpath(".//li/span[@class='zg_selected']")[0]
+        return not selected.getparent().getparent().xpath(".//ul/li/a")
+
     def get_info(self, cate_filter, is_exist):
         url_ls = []
         asin_ls = []
@@ -0,0 +1,88 @@
+import json
+import time
+import sqlite3
+from util.log import logger
+
+
+class CategoryTree:
+    """Best seller category tree of each root, kept in a local sqlite file.
+
+    A full run walks the tree from its root and saves every category it
+    meets: url, parent, leaf flag and the pagination urls of leaves. Until
+    the tree is older than the recheck interval, later runs of the same
+    root and filter (the scope) go straight to the leaf pages. An empty
+    path disables the store, every run is a full one.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._conn = None
+
+    def _get_conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._path, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS bsr_tree ("
+                               "scope TEXT PRIMARY KEY, check_time INTEGER NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS bsr_category ("
+                               "scope TEXT NOT NULL, cate_key TEXT NOT NULL, url TEXT NOT NULL, "
+                               "parent_key TEXT, is_leaf INTEGER NOT NULL, page_url_ls TEXT NOT NULL, "
+                               "check_time INTEGER NOT NULL, PRIMARY KEY (scope, cate_key))")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def get_scope(root_url, cate_filter):
+        return '|'.join([root_url] + sorted(cate_filter))
+
+    def load_leaves(self, scope, recheck_interval):
+        """Return [(url, page_url_ls)] of the leaves of a scope, None if its
+        tree is unknown or due for a full run
+        """
+        if not self._path:
+            return None
+        try:
+            conn = self._get_conn()
+            row = conn.execute("SELECT check_time FROM bsr_tree WHERE scope=?", (scope,)).fetchone()
+            if not row or row[0] + recheck_interval < time.time():
+                return None
+            row_ls = conn.execute("SELECT url, page_url_ls FROM bsr_category "
+                                  "WHERE scope=? AND is_leaf=1", (scope,)).fetchall()
+        except sqlite3.Error as exc:
+            logger.error("load category tree error: %s" % exc)
+            return None
+        return [(url, json.loads(page_url_ls)) for url, page_url_ls in row_ls] or None
+
+    def save(self, scope, node_map, prune):
+        """Save the categories met by a full run
+
+        node_map is {cate_key: (url, parent_key, is_leaf, page_url_ls)}. With
+        prune, categories the run didn't meet are removed, only a run which
+        crawled every page should prune.
+        """
+        if not self._path:
+            return
+        check_time = int(time.time())
+        try:
+            conn = self._get_conn()
+            conn.executemany("INSERT OR REPLACE INTO bsr_category (scope, cate_key, url, parent_key, "
+                             "is_leaf, page_url_ls, check_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             [(scope, key, url, parent_key, int(is_leaf), json.dumps(page_url_ls), check_time)
+                              for key, (url, parent_key, is_leaf, page_url_ls) in node_map.items()])
+            if prune:
+                conn.execute("DELETE FROM bsr_category WHERE scope=? AND check_time<?", (scope, check_time))
+            conn.execute("INSERT OR REPLACE INTO bsr_tree (scope, check_time) VALUES (?, ?)",
+                         (scope, check_time))
+            conn.commit()
+        except sqlite3.Error as exc:
+            logger.error("save category tree error: %s" % exc)
+
+    def expire(self, scope):
+        """Make the next run of a scope a full one"""
+        if not self._path:
+            return
+        try:
+            conn = self._get_conn()
+            conn.execute("DELETE FROM bsr_tree WHERE scope=?", (scope,))
+            conn.commit()
+        except sqlite3.Error as exc:
+            logger.error("expire category tree error: %s" % exc)
@@ -0,0 +1,8 @@
+import numpy as np
+
+
+POPT_KEY_PREFIX = "bestseller:popt:"
+# published after the popt hashes change
+POPT_NOTIFY_CHANNEL = "bestseller:popt:update"
+# estimated sales of a best seller rank, popt is [a, b]
+CURVE_FUNC = lambda x,a,b:np.log(a/x+1)/b
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""Fit the rank to sales curve of each category and write the popt hashes.
+
+    python -m amz_bsr_result.popt_fit -p amazon_us samples.csv ...
+
+Samples are csv files with a category, rank and sales column. Each
+category with MIN_SAMPLES samples gets its own [a, b] of
+sales = log(a/rank+1)/b, and 'default' is fitted on every sample. The
+hash bestseller:popt:<platform> is replaced as a whole and the change is
+published, so a running amz_bsr_result picks it up within seconds.
+"""
+import csv
+import json
+import argparse
+import concurrent.futures
+import numpy as np
+from .curve import POPT_KEY_PREFIX, POPT_NOTIFY_CHANNEL, CURVE_FUNC
+
+
+MIN_SAMPLES = 10
+# samples a fit is computed on at most, metrics are computed on all of them
+MAX_FIT_SAMPLES = 20000
+# a is searched on a log scale grid, then refined around the best one
+A_GRID = np.logspace(0, 9, 181)
+REFINE_ROUNDS = 3
+REFINE_POINTS = 41
+
+
+def fit_curve(rank_arr, sales_arr):
+    """Least squares [a, b] of sales = log(a/rank+1)/b
+
+    For a given a the curve is linear in 1/b, so the best b of every
+    candidate a comes in closed form, all of them at once.
+    """
+    x = rank_arr
+    y = sales_arr
+    if len(x) > MAX_FIT_SAMPLES:
+        index_arr = np.random.RandomState(0).choice(len(x), MAX_FIT_SAMPLES, replace=False)
+        x = x[index_arr]
+        y = y[index_arr]
+    a_grid = A_GRID
+    for i in range(REFINE_ROUNDS+1):
+        g = np.log(a_grid[:, None]/x[None, :] + 1)
+        c = g.dot(y) / np.einsum('ij,ij->i', g, g)
+        sse = ((c[:, None]*g - y[None, :])**2).sum(axis=1)
+        sse[~(c > 0)] = np.inf
+        best = int(np.argmin(sse))
+        if not np.isfinite(sse[best]):
+            return None
+        a, b = a_grid[best], 1/c[best]
+        if i < REFINE_ROUNDS:
+            a_grid = np.geomspace(a_grid[max(best-1, 0)], a_grid[min(best+1, len(a_grid)-1)],
+                                  REFINE_POINTS)
+    return [float(a), float(b)]
+
+
+def fit_metrics(popt, rank_arr, sales_arr):
+    pred_arr = CURVE_FUNC(rank_arr, *popt)
+    err_arr = pred_arr - sales_arr
+    sst = ((sales_arr - sales_arr.mean())**2).sum()
+    nonzero = sales_arr > 0
+    return {
+        'samples': len(sales_arr),
+        'r2': float(1 - (err_arr**2).sum()/sst) if sst > 0 else 0.0,
+        'rmse': float(np.sqrt((err_arr**2).mean())),
+        'mape': float(np.abs(err_arr[nonzero]/sales_arr[nonzero]).mean()) if nonzero.any() else 0.0,
+    }
+
+
+def fit_category(item):
+    """Fit one category, run in the worker processes"""
+    category, rank_arr, sales_arr = item
+    popt = fit_curve(rank_arr, sales_arr)
+    if popt is None:
+        return category, None, None
+    return category, popt, fit_metrics(popt, rank_arr, sales_arr)
+
+
+def load_samples(path_ls):
+    """Return {category: (rank_arr, sales_arr)}, categories as get_popt looks them up
+    """
+    sample_map = {}
+    for path in path_ls:
+        with open(path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                try:
+                    rank = float(row['rank'])
+                    sales = float(row['sales'])
+                except (TypeError, ValueError):
+                    continue
+                if rank <= 0 or sales < 0:
+                    continue
+                category = row['category'].strip().lower()
+                rank_ls, sales_ls = sample_map.setdefault(category, ([], []))
+                rank_ls.append(rank)
+                sales_ls.append(sales)
+    return dict([(k, (np.array(rank_ls), np.array(sales_ls)))
+                 for k, (rank_ls, sales_ls) in sample_map.items()])
+
+
+def fit_all(sample_map, workers=None):
+    """Return {category: (popt, metrics)}, with 'default' fitted on every sample
+    """
+    item_ls = [(k, rank_arr, sales_arr) for k, (rank_arr, sales_arr) in sample_map.items()
+               if len(rank_arr) >= MIN_SAMPLES and k != 'default']
+    if sample_map:
+        item_ls.append(('default',
+                        np.concatenate([rank_arr for rank_arr, _ in sample_map.values()]),
+                        np.concatenate([sales_arr for _, sales_arr in sample_map.values()])))
+    # biggest first, so a large category doesn't end up alone at the tail
+    item_ls.sort(key=lambda item: -len(item[1]))
+    result_map = {}
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for category, popt, metrics in executor.map(fit_category, item_ls, chunksize=8):
+            if popt is not None:
+                result_map[category] = (popt, metrics)
+    return result_map
+
+
+def save_popt(platform, result_map):
+    import redis
+    from config import REDIS_CONF
+    redis_client = redis.Redis(**REDIS_CONF)
+    key_name = POPT_KEY_PREFIX + platform
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(key_name)
+    pipe.hset(key_name, mapping=dict([(k, json.dumps(popt)) for k, (popt, _) in result_map.items()]))
+    pipe.publish(POPT_NOTIFY_CHANNEL, platform)
+    pipe.execute()
+    redis_client.connection_pool.disconnect()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit bestseller popt of a platform')
+    parser.add_argument('-p', '--platform', dest='platform', required=True)
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=None,
+                        help='processes, one per core by default')
+    parser.add_argument('-n', '--dry-run', dest='dry_run', action='store_true',
+                        help='report the fits without writing them')
+    parser.add_argument('-r', '--report', dest='report', help='write the metrics to a csv file')
+    parser.add_argument('samples', nargs='+', help='csv files with category,rank,sales columns')
+    args = parser.parse_args()
+
+    sample_map = load_samples(args.samples)
+    result_map = fit_all(sample_map, args.workers)
+    if 'default' not in result_map:
+        parser.error("no curve could be fitted")
+    row_ls = sorted([(k, popt, metrics) for k, (popt, metrics) in result_map.items()],
+                    key=lambda row: -row[2]['samples'])
+    print("%-40s %8s %12s %10s %7s %10s %7s" % ('category', 'samples', 'a', 'b', 'r2', 'rmse', 'mape'))
+    for category, popt, metrics in row_ls:
+        print("%-40s %8d %12.4g %10.4g %7.3f %10.4g %7.3f" % (
+              category[:40], metrics['samples'], popt[0], popt[1],
+              metrics['r2'], metrics['rmse'], metrics['mape']))
+    print("%d categories fitted, %d skipped with less than %d samples" % (
+          len(result_map)-1, len([k for k in sample_map if k not in result_map]), MIN_SAMPLES))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['category', 'samples', 'a', 'b', 'r2', 'rmse', 'mape'])
+            for category, popt, metrics in row_ls:
+                writer.writerow([category, metrics['samples'], popt[0], popt[1],
+                                 metrics['r2'], metrics['rmse'], metrics['mape']])
+    if not args.dry_run:
+        save_popt(args.platform, result_map)
@@ -1,21 +1,144 @@
 import json
 import time
-import math
 import redis
 import socket
+import asyncio
 import functools
+import threading
+import numpy as np
 import pipeflow
 from util.log import logger
 from util.task_protocal import TaskProtocal
-from pipeflow import RabbitmqInputEndpoint, RabbitmqOutputEndpoint
+from util.rabbitmq_endpoints import RabbitmqInputEndpoint
+from .curve import POPT_KEY_PREFIX, POPT_NOTIFY_CHANNEL, CURVE_FUNC
 from config import RABBITMQ_CONF, REDIS_CONF, BSR_REDIS_CONF
 
 
-POPT_KEY_PREFIX = "bestseller:popt:"
-CURVE_FUNC = lambda x,a,b:math.log(a/x+1)/b
+OUTPUT_KEY = "amz_product:output:bsr"
+# results are estimated and pushed by batches of BATCH_SIZE, or whatever
+# came within BATCH_LINGER_MS of the first result of a batch
+BATCH_SIZE = 200
+BATCH_LINGER_MS = 50
+# curves are reloaded this often, and soon after a change is notified by a
+# message on POPT_NOTIFY_CHANNEL or a keyspace event of a popt hash (needs
+# notify-keyspace-events to include Kh on the redis server)
+POPT_REFRESH_INTERVAL = 600
+POPT_NOTIFY_DELAY = 1
+# {platform: {category: [a, b]}}, never modified, get_popt swaps in a new one
 popt_map = {}
 
 
+def redis_retry(redis_client, func):
+    @functools.wraps(func)
+    def redis_execute_wrapper(*args, **kwargs):
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except redis.ConnectionError as e:
+                logger.error('Redis ConnectionError')
+                redis_client.connection_pool.disconnect()
+                continue
+            except redis.TimeoutError as e:
+                logger.error('Redis TimeoutError')
+                redis_client.connection_pool.disconnect()
+                continue
+    return redis_execute_wrapper
+
+
+def estimate_sales(info_ls):
+    """cat_1_sales of a batch of products, -1 if it can't be estimated
+
+    Products are grouped by (platform, category), the curve of each group
+    is applied to all its ranks at once. A malformed product, or a group
+    without a curve (no category nor 'default' one), is left at -1 and
+    doesn't stop the rest of the batch.
+    """
+    table = popt_map
+    group_map = {}
+    rank_ls = []
+    for i, info in enumerate(info_ls):
+        try:
+            detail_info = info['detail_info']
+            cat_name = detail_info['cat_1_name'].strip().lower() if detail_info['cat_1_name'] else ''
+            cat_rank = float(detail_info['cat_1_rank']) if detail_info['cat_1_rank'] is not None else -1
+        except (KeyError, TypeError, ValueError, AttributeError) as exc:
+            logger.error('Bad product of %s: %r' % (info.get('platform'), exc))
+            cat_name, cat_rank = '', -1
+        rank_ls.append(cat_rank)
+        if cat_name and cat_rank != -1 and table.get(info.get('platform')):
+            group_map.setdefault((info['platform'], cat_name), []).append(i)
+    rank_arr = np.array(rank_ls, dtype=np.float64)
+    sales_arr = np.full(len(info_ls), -1, dtype=np.float64)
+    estimated = np.zeros(len(info_ls), dtype=bool)
+    with np.errstate(all='ignore'):
+        for (platform, cat_name), index_ls in group_map.items():
+            popt_dct = table[platform]
+            popt = popt_dct.get(cat_name, popt_dct.get('default'))
+            if popt is None:
+                continue
+            index_arr = np.array(index_ls)
+            try:
+                sales_arr[index_arr] = CURVE_FUNC(rank_arr[index_arr], *popt)
+            except (TypeError, ValueError) as exc:
+                logger.error('Bad popt of %s %s: %r' % (platform, cat_name, exc))
+                continue
+            estimated[index_arr] = True
+    # a rank out of the curve's domain isn't an estimation, and NaN isn't json
+    estimated &= np.isfinite(sales_arr)
+    return [sales if is_estimated else -1
+            for sales, is_estimated in zip(sales_arr.tolist(), estimated.tolist())]
+
+
+class ResultBatcher(object):
+    """Collect results of the workers, push each batch with one redis command
+
+    add() returns once the batch of the result is pushed, so the worker slot
+    is held until then and the number of workers bounds the batch size.
+    """
+    def __init__(self, key, redis_conf):
+        self._key = key
+        self._redis_client = redis.Redis(**redis_conf)
+        self._info_ls = []
+        self._future = None
+        self._timer = None
+
+    async def add(self, info):
+        loop = asyncio.get_event_loop()
+        if self._future is None:
+            self._future = loop.create_future()
+            self._timer = loop.call_later(BATCH_LINGER_MS/1000, self._flush)
+        future = self._future
+        self._info_ls.append(info)
+        if len(self._info_ls) >= BATCH_SIZE:
+            self._flush()
+        await future
+
+    def _flush(self):
+        if self._future is None:
+            return
+        info_ls, future = self._info_ls, self._future
+        self._info_ls, self._future = [], None
+        self._timer.cancel()
+        asyncio.ensure_future(self._push(info_ls, future))
+
+    async def _push(self, info_ls, future):
+        loop = asyncio.get_event_loop()
+        try:
+            for info, sales in zip(info_ls, estimate_sales(info_ls)):
+                if isinstance(info.get('detail_info'), dict):
+                    info['detail_info']['cat_1_sales'] = sales
+            data_ls = [json.dumps(info).encode('utf-8') for info in info_ls]
+            await loop.run_in_executor(None, redis_retry(self._redis_client, self._redis_client.lpush),
+                                       self._key, *data_ls)
+        except Exception as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(len(data_ls))
+
+
+batcher = None
+
+
 async def handle_worker(group, task):
     """Handle amz_bsr_result task
 
@@ -38,15 +161,10 @@ async def handle_worker(group, task):
                 +"date": "2017-09-10",
                 -"extra",
             }
+        pushed to OUTPUT_KEY by batches, see ResultBatcher
     """
     tp = TaskProtocal(task)
     info = tp.get_data()
-    popt_dct = popt_map.get(info['platform'], {})
-    cat_name = info['detail_info']['cat_1_name'].strip().lower() if info['detail_info']['cat_1_name'] else ''
-    cat_rank = info['detail_info']['cat_1_rank'] if info['detail_info']['cat_1_rank'] is not None else -1
-    info['detail_info']['cat_1_sales'] = -1
-    if cat_name and cat_rank != -1 and popt_dct:
-        info['detail_info']['cat_1_sales'] = CURVE_FUNC(cat_rank, *popt_dct.get(cat_name, popt_dct['default']))
     if info.get('extra') and info['extra'].get('bsr'):
         info['bs_cate'] = info['extra']['bsr']['bs_cate']
         info['date'] = info['extra']['bsr']['date']
@@ -57,53 +175,90 @@ async def handle_worker(group, task):
             cate = ':'.join(info['detail_info']['cat_ls'][0]['name_ls'])
         info['bs_cate'] = [cate]
         info['date'] = time.strftime("%Y-%m-%d", time.localtime())
-    res = pipeflow.Task(json.dumps(info).encode('utf-8'))
-    res.set_to('output')
-    return res
+    try:
+        await batcher.add(info)
+    except Exception as exc:
+        exc_info = (type(exc), exc, exc.__traceback__)
+        logger.error('Push result error', exc_info=exc_info)
+        exc.__traceback__ = None
 
 
 def get_popt():
+    """Load every popt hash and swap them in at once
+    """
     global popt_map
     redis_client = redis.Redis(**REDIS_CONF)
+    redis_execute = functools.partial(redis_retry, redis_client)
+
+    def fetch():
+        key_ls = list(redis_client.scan_iter(POPT_KEY_PREFIX+'*', count=1000))
+        pipe = redis_client.pipeline(transaction=False)
+        for key_name in key_ls:
+            pipe.hgetall(key_name)
+        return key_ls, pipe.execute()
 
-    def redis_execute(func):
-        @functools.wraps(func)
-        def redis_execute_wrapper(*args, **kwargs):
-            while True:
-                try:
-                    return func(*args, **kwargs)
-                except redis.ConnectionError as e:
-                    logger.error('Redis ConnectionError')
-                    redis_client.connection_pool.disconnect()
-                    continue
-                except redis.TimeoutError as e:
-                    logger.error('Redis TimeoutError')
-                    redis_client.connection_pool.disconnect()
-                    continue
-        return redis_execute_wrapper
-
-    key_ls = redis_execute(redis_client.keys)(POPT_KEY_PREFIX+'*')
-    for key_name in key_ls:
+    new_popt_map = {}
+    for key_name, dct in zip(*redis_execute(fetch)()):
         key_name = key_name.decode('utf-8')
         platform = key_name.replace(POPT_KEY_PREFIX, '')
-        dct = redis_execute(redis_client.hgetall)(key_name)
         if dct:
-            popt_map[platform] = {}
+            new_popt_map[platform] = {}
             for k,v in dct.items():
                 k = k.decode('utf-8')
                 v = v.decode('utf-8')
-                popt_map[platform][k] = json.loads(v)
+                new_popt_map[platform][k] = json.loads(v)
     redis_client.connection_pool.disconnect()
+    popt_map = new_popt_map
+
+
+def listen_popt(loop, event):
+    """Set event on each popt change notification, run in a thread
+    """
+    redis_client = redis.Redis(**REDIS_CONF)
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(POPT_NOTIFY_CHANNEL)
+            pubsub.psubscribe('__keyspace@%d__:%s*' % (REDIS_CONF.get('db', 0), POPT_KEY_PREFIX))
+            for message in pubsub.listen():
+                loop.call_soon_threadsafe(event.set)
+        except (redis.ConnectionError, redis.TimeoutError):
+            logger.error('Redis popt subscribe error')
+            redis_client.connection_pool.disconnect()
+            time.sleep(1)
+
+
+async def refresh_popt(server):
+    loop = asyncio.get_event_loop()
+    event = asyncio.Event()
+    threading.Thread(target=listen_popt, args=(loop, event), daemon=True).start()
+    while True:
+        try:
+            await asyncio.wait_for(event.wait(), POPT_REFRESH_INTERVAL)
+            # a fit writes many hashes, reload once they have landed
+            await asyncio.sleep(POPT_NOTIFY_DELAY)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+        try:
+            await loop.run_in_executor(None, get_popt)
+        except Exception as exc:
+            exc_info = (type(exc), exc, exc.__traceback__)
+            logger.error('Reload popt error', exc_info=exc_info)
+            exc.__traceback__ = None
+        else:
+            logger.info("popt reloaded, %d platforms" % len(popt_map))
 
 
 def run():
+    global batcher
     get_popt()
-    input_end = RabbitmqInputEndpoint('amz_bsr_result:input', **RABBITMQ_CONF)
-    output_end = pipeflow.RedisOutputEndpoint('amz_product:output:bsr', **BSR_REDIS_CONF)
+    batcher = ResultBatcher(OUTPUT_KEY, BSR_REDIS_CONF)
+    input_end = RabbitmqInputEndpoint('amz_bsr_result:input', qos=BATCH_SIZE, buffered=True, **RABBITMQ_CONF)
 
     server = pipeflow.Server()
-    group = server.add_group('main', 1)
+    server.add_worker(refresh_popt)
+    group = server.add_group('main', BATCH_SIZE)
     group.set_handle(handle_worker)
     group.add_input_endpoint('input', input_end)
-    group.add_output_endpoint('output', output_end)
     server.run()
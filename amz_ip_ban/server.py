@@ -4,16 +4,22 @@ import redis
 import socket
 import asyncio
 import aiohttp
-import functools
 import pipeflow
+import redis.asyncio as aioredis
 from util.log import logger
 from util.task_protocal import TaskProtocal
-from pipeflow import RabbitmqInputEndpoint, TimeInputEndpoint, TimeOutputEndpoint
+from util.rabbitmq_endpoints import RabbitmqInputEndpoint
+from pipeflow import TimeInputEndpoint, TimeOutputEndpoint
 from config import RABBITMQ_CONF, IP_REDIS_CONF
 
 
-MAX_WORKERS = 1
+MAX_WORKERS = 100
 KEY_NAME = "proxy"
+# ban/release events of this many seconds go to redis in one pipeline
+COALESCE_WINDOW = 0.2
+# a failed pipeline is retried after BACKOFF_BASE, doubled up to BACKOFF_MAX
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
 conf = {
     "socket_timeout": 30,
     "socket_connect_timeout": 15,
@@ -25,61 +31,134 @@ conf = {
     }
 }
 conf.update(IP_REDIS_CONF)
-redis_client = redis.Redis(**conf)
-
-
-def redis_execute(func):
-    @functools.wraps(func)
-    def redis_execute_wrapper(*args, **kwargs):
-        while True:
-            try:
-                return func(*args, **kwargs)
-            except redis.ConnectionError as e:
-                logger.error('Redis ConnectionError')
-                redis_client.connection_pool.disconnect()
-                continue
-            except redis.TimeoutError as e:
-                logger.error('Redis TimeoutError')
-                redis_client.connection_pool.disconnect()
-                continue
-    return redis_execute_wrapper
-
-
-def remove_proxy(group, task):
+
+
+class ProxyUpdater(object):
+    """Apply proxy bans (SREM) and releases (SADD) to the proxy set by batches
+
+    Events of COALESCE_WINDOW are sent in one pipeline, the last event of a
+    proxy wins and the repeated bans of a proxy collapse into the first.
+    A batch failing on redis is kept and retried with a capped backoff,
+    the event loop is never blocked meanwhile.
+    """
+    def __init__(self, redis_conf):
+        self._redis_client = aioredis.Redis(**redis_conf)
+        self._event_map = {}
+        self._flush_handle = None
+        self._failures = 0
+
+    def ban(self, proxy):
+        """Return a future, True when this event removed the proxy"""
+        return self._add(proxy, 'ban')
+
+    def release(self, proxy):
+        """Return a future, True when this event added the proxy back"""
+        return self._add(proxy, 'release')
+
+    def _add(self, proxy, action):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        event = self._event_map.get(proxy)
+        if event is not None and event[0] == action:
+            # reported by another crawler in the same window
+            future.set_result(False)
+            return future
+        if event is not None:
+            event[1].set_result(False)
+        self._event_map[proxy] = (action, future)
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(COALESCE_WINDOW, self._start_flush)
+        return future
+
+    def _start_flush(self):
+        asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        loop = asyncio.get_event_loop()
+        event_ls = list(self._event_map.items())
+        self._event_map = {}
+        try:
+            pipe = self._redis_client.pipeline(transaction=False)
+            for proxy, (action, _) in event_ls:
+                if action == 'ban':
+                    pipe.srem(KEY_NAME, proxy)
+                else:
+                    pipe.sadd(KEY_NAME, proxy)
+            ret_ls = await pipe.execute()
+        except (redis.ConnectionError, redis.TimeoutError) as exc:
+            self._failures += 1
+            delay = min(BACKOFF_BASE * 2**(self._failures-1), BACKOFF_MAX)
+            logger.error('Redis %s, retry %d events in %.1fs' % (type(exc).__name__, len(event_ls), delay))
+            for proxy, event in event_ls:
+                if proxy in self._event_map:
+                    # a newer event of the proxy came during the flush
+                    event[1].set_result(False)
+                else:
+                    self._event_map[proxy] = event
+            self._flush_handle = loop.call_later(delay, self._start_flush)
+            return
+        except Exception as exc:
+            for _, (_, future) in event_ls:
+                future.set_exception(exc)
+        else:
+            self._failures = 0
+            logger.info("flush %d proxy events" % len(event_ls))
+            for (_, (_, future)), ret in zip(event_ls, ret_ls):
+                future.set_result(bool(ret))
+        self._flush_handle = None
+        if self._event_map:
+            self._flush_handle = loop.call_later(COALESCE_WINDOW, self._start_flush)
+
+
+proxy_updater = ProxyUpdater(conf)
+
+
+async def remove_proxy(group, task):
     """Handle proxy remove
     """
     tp = TaskProtocal(task)
     task_dct = tp.get_data()
     logger.info("remove %s" % task_dct)
     if task_dct['proxy']:
-        ret = redis_execute(redis_client.srem)(KEY_NAME, task_dct['proxy'])
+        try:
+            ret = await proxy_updater.ban(task_dct['proxy'])
+        except Exception as exc:
+            exc_info = (type(exc), exc, exc.__traceback__)
+            logger.error('Remove proxy error', exc_info=exc_info)
+            exc.__traceback__ = None
+            return
         if ret:
             tp.set_to('output')
             return tp
 
 
-def release_proxy(group, task):
+async def release_proxy(group, task):
     """Handle proxy release
     """
     tp = TaskProtocal(task)
     task_dct = tp.get_data()
     logger.info("release %s" % task_dct)
     if task_dct['proxy']:
-        redis_execute(redis_client.sadd)(KEY_NAME, task_dct['proxy'])
+        try:
+            await proxy_updater.release(task_dct['proxy'])
+        except Exception as exc:
+            exc_info = (type(exc), exc, exc.__traceback__)
+            logger.error('Release proxy error', exc_info=exc_info)
+            exc.__traceback__ = None
 
 
 def run():
-    ban_input_end = RabbitmqInputEndpoint('amz_ip_ban:input', **RABBITMQ_CONF)
+    ban_input_end = RabbitmqInputEndpoint('amz_ip_ban:input', qos=MAX_WORKERS, buffered=True, **RABBITMQ_CONF)
     release_ip_end = TimeInputEndpoint('amz_banned_ip', **IP_REDIS_CONF)
     ban_ip_end = TimeOutputEndpoint([('amz_banned_ip', 2880)], **IP_REDIS_CONF)
 
     server = pipeflow.Server()
-    group = server.add_group('remove', 1)
+    group = server.add_group('remove', MAX_WORKERS)
     group.add_input_endpoint('input', ban_input_end)
     group.add_output_endpoint('output', ban_ip_end)
     group.set_handle(remove_proxy)
 
-    group = server.add_group('realse', 1)
+    group = server.add_group('realse', MAX_WORKERS)
     group.add_input_endpoint('input', release_ip_end)
     group.set_handle(release_proxy)
     server.run()
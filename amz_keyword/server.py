@@ -5,6 +5,7 @@ from lxml import etree
 from util.log import logger
 from util.prrequest import GetPageSession
 from util.task_protocal import TaskProtocal
+from util.parse_executor import ParseExecutor
 from error import RequestError, CaptchaError, BannedError
 from pipeflow import RabbitmqInputEndpoint, RabbitmqOutputEndpoint
 from .spiders.dispatch import get_spider_by_platform, get_search_index_url, formalize_url
@@ -12,7 +13,27 @@ from config import RABBITMQ_CONF
 
 
 MAX_WORKERS = 30
+# parse pages in a pool of processes, 0 means parse on the event loop
+PARSE_WORKERS = 0
 task_count = 0
+parse_executor = ParseExecutor([__name__])
+
+
+def parse_page(platform, html):
+    """Extract search result from page html, None if it isn't a search page
+
+    Run by parse_executor, so it only takes and returns picklable objects.
+    """
+    soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
+    handle = get_spider_by_platform(platform)(soup)
+    if not handle.is_search_page():
+        return None
+    return {
+        'next_url': handle.get_next_url(),
+        'asin_ls': handle.get_asins(),
+        'result': handle.get_search_result(),
+        'department': handle.get_nav_search(),
+    }
 
 
 async def handle_worker(group, task):
@@ -50,14 +71,11 @@ async def handle_worker(group, task):
     notify_task.set_to('notify')
     if task_dct['page'] > task_dct['end_page']:
         return notify_task
-    handle_cls = get_spider_by_platform(task_dct['platform'])
 
     with GetPageSession() as sess:
         try:
             #sess = GetPageSession()
             html = await sess.get_page('get', task_dct['url'], timeout=60, captcha_bypass=True)
-            soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
-            handle = handle_cls(soup)
         except BannedError as exc:
             tp.set_to('input_back')
             ban_tp = tp.new_task({'proxy': exc.proxy[7:]})
@@ -88,21 +106,20 @@ async def handle_worker(group, task):
             tps.append(new_tp)
             return tps
 
-    is_search_page = handle.is_search_page()
-    if not is_search_page:
-        return notify_task
-
     try:
-        next_url = handle.get_next_url()
-        asin_ls = handle.get_asins()
-        result_dct = handle.get_search_result()
-        department = handle.get_nav_search()
+        page = await parse_executor.run(parse_page, task_dct['platform'], html)
     except Exception as exc:
         exc_info = (type(exc), exc, exc.__traceback__)
         taks_info = ' '.join([task_dct['platform'], task_dct['url']])
         logger.error('Get page info error\n'+taks_info, exc_info=exc_info)
         exc.__traceback__ = None
         return notify_task
+    if page is None:
+        return notify_task
+    next_url = page['next_url']
+    asin_ls = page['asin_ls']
+    result_dct = page['result']
+    department = page['department']
 
     if next_url is not None:
         next_url = formalize_url(task_dct['platform'], next_url)
@@ -177,6 +194,7 @@ async def handle_task(group, task):
                 group.resume_endpoint('input')
 
 def run():
+    parse_executor.start(PARSE_WORKERS)
     input_end = RabbitmqInputEndpoint('amz_keyword:input', **RABBITMQ_CONF)
     output_end = RabbitmqOutputEndpoint(['amz_keyword:input', 'amz_keyword:output',
                                          'amz_ip_ban:input'], **RABBITMQ_CONF)
@@ -6,16 +6,38 @@ from error import RequestError, CaptchaError, BannedError
 from util.log import logger
 from util.prrequest import GetPageSession
 from util.task_protocal import TaskProtocal
+from util.parse_executor import ParseExecutor
 from .spiders.dispatch import get_spider_by_platform, get_url_by_platform, get_domain_by_platform
 from pipeflow import RabbitmqInputEndpoint, RabbitmqOutputEndpoint
 from config import RABBITMQ_CONF
 
 
 MAX_WORKERS = 25
+# parse pages in a pool of processes, 0 means parse on the event loop
+PARSE_WORKERS = 0
 COLLECT_COUPON = "https://{domain:s}/gp/collect-coupon/handler/applicable_promotion_list_hover_count.html?ref_=apl_desktop_imp"
 ADD_TO_CART = "https://{domain:s}/gp/add-to-cart/json/ref=dp_start-bbf_1_glance"
 ADD_TO_CART_DATA = "clientName=SmartShelf&ASIN={asin:s}&verificationSessionID={session_id:s}&offerListingID={offer_listing_id:s}&quantity={qty:d}"
 
+parse_executor = ParseExecutor([__name__])
+
+
+def parse_page(platform, html, with_qty=False):
+    """Extract product info from page html
+
+    Run by parse_executor, so it only takes and returns picklable objects.
+    """
+    soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
+    handle = get_spider_by_platform(platform)(soup)
+    page = {'is_product_page': handle.is_product_page(), 'info': None}
+    if with_qty:
+        page['offer_listing_id'] = handle.get_offer_listing_id()
+        page['ue_id'] = handle.get_ue_id()
+        page['session_id'] = handle.get_session_id()
+    if page['is_product_page']:
+        page['info'] = handle.get_info()
+    return page
+
 
 async def handle_worker(group, task):
     """Handle amz_product task
@@ -81,24 +103,18 @@ async def handle_worker(group, task):
     task_dct = tp.get_data()
     logger.info("%s %s %s" % (task_dct['platform'], task_dct['asin'], task_dct.get('with_qty', False)))
 
-    handle_cls = get_spider_by_platform(task_dct['platform'])
     url = get_url_by_platform(task_dct['platform'], task_dct['asin'])
     qty_info = {}
     with GetPageSession() as sess:
         try:
-            if not task_dct.get('with_qty'):
-                #sess = GetPageSession()
-                html = await sess.get_page('get', url, timeout=60, captcha_bypass=True)
-                soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
-                handle = handle_cls(soup)
-            else:
-                #sess = GetPageSession()
-                html = await sess.get_page('get', url, timeout=60, captcha_bypass=True)
-                soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
-                handle = handle_cls(soup)
-                offer_listing_id = handle.get_offer_listing_id()
-                ue_id = handle.get_ue_id()
-                session_id = handle.get_session_id()
+            #sess = GetPageSession()
+            html = await sess.get_page('get', url, timeout=60, captcha_bypass=True)
+            page = await parse_executor.run(parse_page, task_dct['platform'], html,
+                                            task_dct.get('with_qty', False))
+            if task_dct.get('with_qty'):
+                offer_listing_id = page['offer_listing_id']
+                ue_id = page['ue_id']
+                session_id = page['session_id']
                 domain = get_domain_by_platform(task_dct['platform'])
                 if offer_listing_id and ue_id and session_id:
                     ### get ubid-main cookie
@@ -132,12 +148,11 @@ async def handle_worker(group, task):
             exc.__traceback__ = None
             return
 
-    is_product_page = handle.is_product_page()
-    if not is_product_page:
+    if not page['is_product_page']:
         return
 
     try:
-        info = handle.get_info()
+        info = page['info']
         info['qty'] = int(qty_info['cartQuantity']) if qty_info.get('cartQuantity') else None
         # extra info
         info['asin'] = task_dct['asin']
@@ -154,6 +169,7 @@ async def handle_worker(group, task):
 
 
 def run():
+    parse_executor.start(PARSE_WORKERS)
     input_end = RabbitmqInputEndpoint('amz_product:input', **RABBITMQ_CONF)
     input5_end = RabbitmqInputEndpoint('amz_product:5:input', **RABBITMQ_CONF)
     output_end = RabbitmqOutputEndpoint(['amz_product:input', 'amz_product:5:input', 'amz_product:output',
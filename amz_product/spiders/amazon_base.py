@@ -1,18 +1,103 @@
 import re
 import json
-import js2py
+from lxml import etree
+from util import js_literal
 
 
-class AMZProductInfo:
+class XPathRegistry(type):
+    """Compile the XPATH expressions of a spider class once, when the class is defined.
+
+    A subclass only declares the expressions it changes, they are layered on top
+    of the compiled expressions inherited from its base class.
+    """
+    def __new__(mcs, name, bases, attrs):
+        cls = super(XPathRegistry, mcs).__new__(mcs, name, bases, attrs)
+        registry = dict(getattr(cls, '_xpath_registry', {}))
+        for key, expr in attrs.get('XPATH', {}).items():
+            registry[key] = etree.XPath(expr)
+        cls._xpath_registry = registry
+        return cls
+
+
+class AMZProductInfo(metaclass=XPathRegistry):
     """Extract product info from page
     """
+    XPATH = {
+        'dp_container': "//div[@id='dp-container']",
+        'parent_asin': "//span[@id='twisterNonJsData']/input[@name='ASIN']/@value",
+        'title': "//*[@id='title']//text()",
+        'brand': "//*[@id='brand']//text()",
+        'byline': "//*[@id='bylineInfo']/text()",
+        'image_block_script': "//*[@id='imageBlock_feature_div']//script[contains(text(),'ImageBlockATF')]/text()",
+        'merchant_info': "//*[@id='merchant-info']//text()",
+        'merchant_name': "//*[@id='merchant-info']//a[contains(@href,'seller/at-a-glance.html/ref=dp_merchant_link')]/text()",
+        'merchant_id': "//form[@id='addToCart']//input[@id='merchantID']/@value",
+        'feature_bullets': "//*[@id='feature-bullets']//ul/li/span[@class='a-list-item']/text()",
+        'product_description': "//*[@id='descriptionAndDetails']//*[@id='productDescription']//text()",
+        'aplus_description': "//*[@id='aplus']//p[@class='a-spacing-base']/text()",
+        'breadcrumbs': "//div[@id='wayfinding-breadcrumbs_feature_div']//li//a/text()",
+        'addon_icon': "//div[@id='addOnItem_feature_div']//*[contains(@class, 'a-icon-addon')]",
+        'bought_together': "//div[@id='sims-fbt-content']//input[contains(@name, 'discoveredAsins')]/@value",
+        'also_bought': "//div[@id='purchase-sims-feature']//div[@data-a-carousel-options]/@data-a-carousel-options",
+        'also_viewed': "//div[@id='session-sims-feature']//div[@data-a-carousel-options]/@data-a-carousel-options",
+        'viewed_also_bought': "//div[@id='recommendations']/ul/li/span/div[1]/a/@href",
+        'sponsored_1': "//div[@id='sp_detail']/@data-a-carousel-options",
+        'sponsored_2': "//div[@id='sp_detail2']/@data-a-carousel-options",
+        'compare_to_similar': "//table[@id='HLCXComparisonTable']//div[contains(@id,'comparison_title')]/a/@href",
+        'sku_mason_script': "//script[contains(text(), 'twister-js-init-mason-data') and contains(text(), 'dataToReturn')]/text()",
+        'sku_dpx_script': "//script[contains(text(), 'twister-js-init-dpx-data') and contains(text(), 'dataToReturn')]/text()",
+        'offer_listing_id': "//input[@id='offerListingID']/@value",
+        'ue_id_script': "//script[contains(text(),'ue_id')]/text()",
+        'ue_sid_script': "//script[contains(text(),'ue_sid')]/text()",
+        # review
+        'review_star': "//div[@id='averageCustomerReviews_feature_div']//i[contains(@class,'a-icon-star')]//text()",
+        'review_count': "//div[@id='averageCustomerReviews_feature_div']//a[@id='acrCustomerReviewLink']//text()",
+        'histogram_row': "//table[@id='histogramTable']//tr[@class='a-histogram-row']",
+        'histogram_star': "./td[1]/a/text()",
+        'histogram_percent': "./td[2]//div[@aria-label]/@aria-label",
+        # price
+        'price_strike': "//div[@id='price_feature_div']//div[@id='price']//*[@class='a-text-strike']//text()",
+        'price_ourprice': "//div[@id='price_feature_div']//div[@id='price']//*[@id='priceblock_ourprice']//text()",
+        'price_saleprice': "//div[@id='price_feature_div']//div[@id='price']//*[contains(@id,'priceblock_saleprice')]//text()",
+        'price_dealprice': "//div[@id='price_feature_div']//div[@id='price']//*[contains(@id,'priceblock_dealprice')]//text()",
+        # product details
+        'detail_bullets': "//*[@id='detail-bullets' or @id='detail_bullets_id']",
+        'detail_bullets_v2': "//*[@id='detailBullets']",
+        'prod_details_tab_row': "//div[@id='prodDetails']//div[@class='pdTab']//table//tr",
+        'prod_details_row': "//div[@id='prodDetails']//table[@role='presentation']//tr",
+        'detail_bullets_sales_rank': ".//div[@class='content']/ul/li[@id='SalesRank']",
+        'detail_bullets_item': ".//div[@class='content']/ul/li",
+        'sales_rank': ".//li[@id='SalesRank']",
+        'detail_bullets_v2_item': ".//div[@id='detailBullets_feature_div']/ul/li/span",
+        'zg_hrsr_item': "./ul[@class='zg_hrsr']/li[@class='zg_hrsr_item']",
+        'value_zg_hrsr_item': "./td[@class='value']/ul[@class='zg_hrsr']/li[@class='zg_hrsr_item']",
+        'zg_hrsr_rank': "./span[@class='zg_hrsr_rank']/text()",
+        'zg_hrsr_ladder': "./span[@class='zg_hrsr_ladder']//a/text()",
+        'text': "./text()",
+        'bold_text': "./b/text()",
+        'span_1_text': "./span[1]/text()",
+        'span_2_text': "./span[2]/text()",
+        'label_text': "./td[@class='label']/text()",
+        'value_text': "./td[@class='value']/text()",
+        'id': "./@id",
+        'th_text': "./th/text()",
+        'td_text': "./td/text()",
+        'td_span_span': "./td/span/span",
+        'link_text': ".//a/text()",
+    }
+
     def __init__(self, soup):
         self.soup = soup
 
+    def xpath(self, name, node=None):
+        """Evaluate the compiled expression `name` against node, the whole page by default
+        """
+        return self._xpath_registry[name](self.soup if node is None else node)
+
     def is_product_page(self):
         """Determinate page is a product page or not
         """
-        if self.soup.xpath("//div[@id='dp-container']"):
+        if self.xpath('dp_container'):
             return True
         return False
 
@@ -61,14 +146,14 @@ class AMZProductInfo:
     def get_parent_asin(self):
         """Extract parent asin
         """
-        asin_ls = self.soup.xpath("//span[@id='twisterNonJsData']/input[@name='ASIN']/@value")
+        asin_ls = self.xpath('parent_asin')
         return {'asin': asin_ls[0] if asin_ls else ''}
 
 
     def get_title(self):
         """Extract title info
         """
-        t_text_ls = self.soup.xpath("//*[@id='title']//text()")
+        t_text_ls = self.xpath('title')
         text_ls = t_text_ls
         title = ' '.join([i.strip() for i in text_ls if i.strip()])
         return {'title': title}
@@ -77,9 +162,9 @@ class AMZProductInfo:
     def get_brand(self):
         """Extract brand info
         """
-        t_text_ls = self.soup.xpath("//*[@id='brand']//text()")
+        t_text_ls = self.xpath('brand')
         if not t_text_ls:
-            t_text_ls = self.soup.xpath("//*[@id='bylineInfo']/text()")
+            t_text_ls = self.xpath('byline')
         text_ls = t_text_ls
         brand = ' '.join([i.strip() for i in text_ls if i.strip()])
         return {'brand': brand}
@@ -90,7 +175,7 @@ class AMZProductInfo:
         """
         img_dct = {'img': '', 'imgs':[]}
         img_ls = []
-        img_info = self.soup.xpath("//*[@id='imageBlock_feature_div']//script[contains(text(),'ImageBlockATF')]/text()")[0]
+        img_info = self.xpath('image_block_script')[0]
         reg_ret = re.search(r"var\s+data\s*=\s*({.+?});", img_info, re.S)
         if reg_ret:
             ls = re.findall(r'''["']large["']\s*:\s*["'](.+?)["']''', reg_ret.group(1), re.M)
@@ -107,10 +192,10 @@ class AMZProductInfo:
     def get_merchants_info(self):
         """Extract merchant info
         """
-        text_ls = self.soup.xpath("//*[@id='merchant-info']//a[contains(@href,'seller/at-a-glance.html/ref=dp_merchant_link')]/text()")
+        text_ls = self.xpath('merchant_name')
         merchant = ' '.join([i.strip() for i in text_ls if i.strip()]).strip()
 
-        text_ls = self.soup.xpath("//form[@id='addToCart']//input[@id='merchantID']/@value")
+        text_ls = self.xpath('merchant_id')
         merchant_id = ' '.join([i.strip() for i in text_ls if i.strip()]).strip()
         return {"merchant": merchant, "merchant_id": merchant_id}
 
@@ -119,15 +204,15 @@ class AMZProductInfo:
         """Extract description info
         """
         description_ls = []
-        text_ls = self.soup.xpath("//*[@id='feature-bullets']//ul/li/span[@class='a-list-item']/text()")
+        text_ls = self.xpath('feature_bullets')
         for text in text_ls:
             text = text.strip()
             if text:
                 description_ls.append(text)
 
-        text_ls = self.soup.xpath("//*[@id='descriptionAndDetails']//*[@id='productDescription']//text()")
+        text_ls = self.xpath('product_description')
         if not text_ls:
-            text_ls = self.soup.xpath("//*[@id='aplus']//p[@class='a-spacing-base']/text()")
+            text_ls = self.xpath('aplus_description')
         for text in text_ls:
             text = text.strip()
             if text:
@@ -138,7 +223,7 @@ class AMZProductInfo:
     def get_category(self):
         """Extract category info
         """
-        category_ls = self.soup.xpath("//div[@id='wayfinding-breadcrumbs_feature_div']//li//a/text()")
+        category_ls = self.xpath('breadcrumbs')
         category_ls = [i.strip() for i in category_ls]
         return category_ls
 
@@ -146,7 +231,7 @@ class AMZProductInfo:
     def get_addon(self):
         """Extract addon item info
         """
-        addon_ls = self.soup.xpath("//div[@id='addOnItem_feature_div']//*[contains(@class, 'a-icon-addon')]")
+        addon_ls = self.xpath('addon_icon')
         if addon_ls:
             return True
         return False
@@ -155,13 +240,13 @@ class AMZProductInfo:
     def get_relative_asin(self):
         """Extract asin from 'bought together' and 'also bought'
         """
-        ls_1 = self.soup.xpath("//div[@id='sims-fbt-content']//input[contains(@name, 'discoveredAsins')]/@value")
-        ls_2 = self.soup.xpath("//div[@id='purchase-sims-feature']//div[@data-a-carousel-options]/@data-a-carousel-options")
-        ls_3 = self.soup.xpath("//div[@id='session-sims-feature']//div[@data-a-carousel-options]/@data-a-carousel-options")
-        ls_4 = self.soup.xpath("//div[@id='recommendations']/ul/li/span/div[1]/a/@href")
-        ls_5 = self.soup.xpath("//div[@id='sp_detail']/@data-a-carousel-options")
-        ls_6 = self.soup.xpath("//div[@id='sp_detail2']/@data-a-carousel-options")
-        ls_7 = self.soup.xpath("//table[@id='HLCXComparisonTable']//div[contains(@id,'comparison_title')]/a/@href")
+        ls_1 = self.xpath('bought_together')
+        ls_2 = self.xpath('also_bought')
+        ls_3 = self.xpath('also_viewed')
+        ls_4 = self.xpath('viewed_also_bought')
+        ls_5 = self.xpath('sponsored_1')
+        ls_6 = self.xpath('sponsored_2')
+        ls_7 = self.xpath('compare_to_similar')
         if ls_2:
             ls_2 = json.loads(ls_2[0])['ajax']['id_list']
         if ls_3:
@@ -194,15 +279,15 @@ class AMZProductInfo:
         """Extract all sku asin
         """
         sku_dct = {}
-        script_text_ls = self.soup.xpath("//script[contains(text(), 'twister-js-init-mason-data') and contains(text(), 'dataToReturn')]/text()")
+        script_text_ls = self.xpath('sku_mason_script')
         if script_text_ls:
             script_text = script_text_ls[0]
-            reg_ret = re.search(r"var\s+dataToReturn\s*=\s*{.+?};", script_text, re.S)
+            reg_ret = re.search(r"var\s+dataToReturn\s*=\s*(?={)", script_text)
             if reg_ret:
-                js_obj = js2py.eval_js(reg_ret.group(0))
-                attr_name_dct = js_obj['variationDisplayLabels'].to_dict()
-                asin_attr_dct = js_obj['asin_variation_values'].to_dict()
-                attr_value_dct = js_obj['variation_values'].to_dict()
+                js_obj, _ = js_literal.raw_decode(script_text, reg_ret.end())
+                attr_name_dct = js_obj['variationDisplayLabels']
+                asin_attr_dct = js_obj['asin_variation_values']
+                attr_value_dct = js_obj['variation_values']
                 for asin in asin_attr_dct:
                     dct = {}
                     for k in asin_attr_dct[asin]:
@@ -213,15 +298,15 @@ class AMZProductInfo:
                     if dct:
                         sku_dct[asin] = dct
         if not sku_dct:
-            script_text_ls = self.soup.xpath("//script[contains(text(), 'twister-js-init-dpx-data') and contains(text(), 'dataToReturn')]/text()")
+            script_text_ls = self.xpath('sku_dpx_script')
             if script_text_ls:
                 script_text = script_text_ls[0]
-                reg_ret = re.search(r"var\s+dataToReturn\s*=\s*{.+?};", script_text, re.S)
+                reg_ret = re.search(r"var\s+dataToReturn\s*=\s*(?={)", script_text)
                 if reg_ret:
-                    js_obj = js2py.eval_js(reg_ret.group(0))
-                    attr_name_dct = js_obj['variationDisplayLabels'].to_dict()
-                    asin_attr_dct = js_obj['asinVariationValues'].to_dict()
-                    attr_value_dct = js_obj['variationValues'].to_dict()
+                    js_obj, _ = js_literal.raw_decode(script_text, reg_ret.end())
+                    attr_name_dct = js_obj['variationDisplayLabels']
+                    asin_attr_dct = js_obj['asinVariationValues']
+                    attr_value_dct = js_obj['variationValues']
                     for asin in asin_attr_dct:
                         dct = {}
                         for k in asin_attr_dct[asin]:
@@ -237,7 +322,7 @@ class AMZProductInfo:
 
     def get_offer_listing_id(self):
         offer_listing_id = ''
-        ls = self.soup.xpath("//input[@id='offerListingID']/@value")
+        ls = self.xpath('offer_listing_id')
         if ls:
             offer_listing_id = ls[0]
         return offer_listing_id
@@ -245,7 +330,7 @@ class AMZProductInfo:
 
     def get_ue_id(self):
         ue_id = ''
-        text = self.soup.xpath("//script[contains(text(),'ue_id')]/text()")[0]
+        text = self.xpath('ue_id_script')[0]
         reg_ret = re.search(r'''\s+ue_id\s*=\s*(?:"|')([^"']+)(?:"|')''', text, re.S)
         if reg_ret:
             ue_id = reg_ret.group(1)
@@ -254,7 +339,7 @@ class AMZProductInfo:
 
     def get_session_id(self):
         session_id = ''
-        text = self.soup.xpath("//script[contains(text(),'ue_sid')]/text()")[0]
+        text = self.xpath('ue_sid_script')[0]
         reg_ret = re.search(r'''\s+ue_sid\s*=\s*(?:"|')([^"']+)(?:"|')''', text, re.S)
         if reg_ret:
             session_id = reg_ret.group(1)
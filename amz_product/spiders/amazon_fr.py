@@ -11,25 +11,25 @@ class AMZFRProductInfo(AMZProductInfo):
     def get_review(self):
         """Extract review info
         """
-        text_ls = self.soup.xpath("//div[@id='averageCustomerReviews_feature_div']//i[contains(@class,'a-icon-star')]//text()")
+        text_ls = self.xpath('review_star')
         review_info = ' '.join([i.strip() for i in text_ls if i.strip()])
         review_score_ls = re.findall(r'[\d.,]+', review_info)
         review_score = 0
         if review_score_ls:
             review_score = float(review_score_ls[0])
-        text_ls = self.soup.xpath("//div[@id='averageCustomerReviews_feature_div']//a[@id='acrCustomerReviewLink']//text()")
+        text_ls = self.xpath('review_count')
         review_info = ' '.join([i.strip() for i in text_ls if i.strip()])
         review_num_ls = re.findall(r'[\d.,]+', review_info)
         review_num = 0
         if review_num_ls:
             review_num = int(review_num_ls[0].replace(',',''))
         review_statistics = {1:0,2:0,3:0,4:0,5:0}
-        tr_ls = self.soup.xpath("//table[@id='histogramTable']//tr[@class='a-histogram-row']")
+        tr_ls = self.xpath('histogram_row')
         for tr in tr_ls:
-            text = ''.join(tr.xpath("./td[1]/a/text()"))
+            text = ''.join(self.xpath('histogram_star', tr))
             reg_res = re.search(r"(\d+)", text)
             star = int(reg_res.group(1)) if reg_res else None
-            text = ''.join(tr.xpath("./td[2]//div[@aria-label]/@aria-label"))
+            text = ''.join(self.xpath('histogram_percent', tr))
             reg_res = re.search(r"(\d+)", text)
             prc = int(reg_res.group(1)) if reg_res else None
             if star is not None and prc is not None:
@@ -41,7 +41,7 @@ class AMZFRProductInfo(AMZProductInfo):
     def is_fba(self):
         """Extract fba info
         """
-        text_ls = self.soup.xpath("//*[@id='merchant-info']//text()")
+        text_ls = self.xpath('merchant_info')
         fba_info = ' '.join([i.strip() for i in text_ls if i.strip()]).lower()
         if 'expédié par amazon' in fba_info:
             return True
@@ -52,18 +52,18 @@ class AMZFRProductInfo(AMZProductInfo):
         """Extract price info
         """
         o_price = price = 0
-        o_price_ls = self.soup.xpath("//div[@id='price_feature_div']//div[@id='price']//*[@class='a-text-strike']//text()")
+        o_price_ls = self.xpath('price_strike')
         price_text = ' '.join([i.strip() for i in o_price_ls if i.strip()])
         price_ls = re.findall(r'[\d.,]+', price_text)
         if price_ls:
             price_text = price_ls[0].replace('.','').replace(',','.')
             o_price = float(price_text)
 
-        price_ls = self.soup.xpath("//div[@id='price_feature_div']//div[@id='price']//*[@id='priceblock_ourprice']//text()")
+        price_ls = self.xpath('price_ourprice')
         if not price_ls:
-            price_ls = self.soup.xpath("//div[@id='price_feature_div']//div[@id='price']//*[contains(@id,'priceblock_saleprice')]//text()")
+            price_ls = self.xpath('price_saleprice')
         if not price_ls:
-            price_ls = self.soup.xpath("//div[@id='price_feature_div']//div[@id='price']//*[contains(@id,'priceblock_dealprice')]//text()")
+            price_ls = self.xpath('price_dealprice')
         price_text = ' '.join([i.strip() for i in price_ls if i.strip()])
         price_ls = re.findall(r'[\d.,]+', price_text)
         if price_ls:
@@ -90,33 +90,33 @@ class AMZFRProductInfo(AMZProductInfo):
             'shipping_weight': None,
             'date_first_available': None,
         }
-        div1 = self.soup.xpath("//*[@id='detail-bullets' or @id='detail_bullets_id']")
-        div2 = self.soup.xpath("//*[@id='detailBullets']")
-        tr_ls1 = self.soup.xpath("//div[@id='prodDetails']//div[@class='pdTab']//table//tr")
-        tr_ls2 = self.soup.xpath("//div[@id='prodDetails']//table[@role='presentation']//tr")
+        div1 = self.xpath('detail_bullets')
+        div2 = self.xpath('detail_bullets_v2')
+        tr_ls1 = self.xpath('prod_details_tab_row')
+        tr_ls2 = self.xpath('prod_details_row')
         if div1:
             div = div1[0]
-            li_ls = div.xpath(".//div[@class='content']/ul/li[@id='SalesRank']")
+            li_ls = self.xpath('detail_bullets_sales_rank', div)
             if li_ls:
                 li = li_ls[0]
-                text = ' '.join(li.xpath("./text()")).strip()
+                text = ' '.join(self.xpath('text', li)).strip()
                 reg_res = re.search(r'([\d.]+)\s+en\s+(.+)\(', text)
                 if reg_res:
                     rank = int(reg_res.group(1).replace('.', ''))
                     name = reg_res.group(2).strip()
                     bsr_dct['cat_1_rank'] = rank
                     bsr_dct['cat_1_name'] = name
-                cat_li_ls = li.xpath("./ul[@class='zg_hrsr']/li[@class='zg_hrsr_item']")
+                cat_li_ls = self.xpath('zg_hrsr_item', li)
                 for li in cat_li_ls:
-                    reg_res = re.search(r'n°([\d.]+)',''.join(li.xpath("./span[@class='zg_hrsr_rank']/text()")))
+                    reg_res = re.search(r'n°([\d.]+)',''.join(self.xpath('zg_hrsr_rank', li)))
                     rank = int(reg_res.group(1).replace('.', '').strip()) if reg_res else None
-                    name_ls = li.xpath("./span[@class='zg_hrsr_ladder']//a/text()")
+                    name_ls = self.xpath('zg_hrsr_ladder', li)
                     bsr_dct['cat_ls'].append({"rank": rank, "name_ls": name_ls})
 
-            li_ls = div.xpath(".//div[@class='content']/ul/li")
+            li_ls = self.xpath('detail_bullets_item', div)
             for li in li_ls:
-                name = ''.join(li.xpath("./b/text()")).replace(":", "").strip().lower()
-                text = ''.join(li.xpath("./text()")).strip()
+                name = ''.join(self.xpath('bold_text', li)).replace(":", "").strip().lower()
+                text = ''.join(self.xpath('text', li)).strip()
                 if 'dimensions du produit' in name:
                     product_info_dct['product_dimensions'] = text
                 elif "poids de l'article" == name:
@@ -127,27 +127,27 @@ class AMZFRProductInfo(AMZProductInfo):
                     product_info_dct[name] = text
         elif div2:
             div = div2[0]
-            li_ls = div.xpath(".//li[@id='SalesRank']")
+            li_ls = self.xpath('sales_rank', div)
             if li_ls:
                 li = li_ls[0]
-                text = ' '.join(li.xpath("./text()")).strip()
+                text = ' '.join(self.xpath('text', li)).strip()
                 reg_res = re.search(r'([\d.]+)\s+en\s+(.+)\(', text)
                 if reg_res:
                     rank = int(reg_res.group(1).replace('.', ''))
                     name = reg_res.group(2).strip()
                     bsr_dct['cat_1_rank'] = rank
                     bsr_dct['cat_1_name'] = name
-                cat_li_ls = li.xpath("./ul[@class='zg_hrsr']/li[@class='zg_hrsr_item']")
+                cat_li_ls = self.xpath('zg_hrsr_item', li)
                 for li in cat_li_ls:
-                    reg_res = re.search(r'n°([\d.]+)',''.join(li.xpath("./span[@class='zg_hrsr_rank']/text()")))
+                    reg_res = re.search(r'n°([\d.]+)',''.join(self.xpath('zg_hrsr_rank', li)))
                     rank = int(reg_res.group(1).replace('.', '').strip()) if reg_res else None
-                    name_ls = li.xpath("./span[@class='zg_hrsr_ladder']//a/text()")
+                    name_ls = self.xpath('zg_hrsr_ladder', li)
                     bsr_dct['cat_ls'].append({"rank": rank, "name_ls": name_ls})
 
-            span_ls = div.xpath(".//div[@id='detailBullets_feature_div']/ul/li/span")
+            span_ls = self.xpath('detail_bullets_v2_item', div)
             for span in span_ls:
-                name = ''.join(span.xpath("./span[1]/text()")).replace(":", "").strip().lower()
-                text = ''.join(span.xpath("./span[2]/text()")).strip()
+                name = ''.join(self.xpath('span_1_text', span)).replace(":", "").strip().lower()
+                text = ''.join(self.xpath('span_2_text', span)).strip()
                 if 'dimensions du produit' in name:
                     product_info_dct['product_dimensions'] = text
                 elif "poids de l'article" == name:
@@ -158,26 +158,26 @@ class AMZFRProductInfo(AMZProductInfo):
                     product_info_dct[name] = text
         elif tr_ls1:
             for tr in tr_ls1:
-                k_ls = tr.xpath("./td[@class='label']/text()")
+                k_ls = self.xpath('label_text', tr)
                 if not k_ls:
                     continue
-                if 'SalesRank' in tr.xpath("./@id"):
-                    text = ' '.join(tr.xpath("./td[@class='value']/text()")).strip()
+                if 'SalesRank' in self.xpath('id', tr):
+                    text = ' '.join(self.xpath('value_text', tr)).strip()
                     reg_res = re.search(r'([\d.]+)\s+en\s+(.+)\(', text)
                     if reg_res:
                         rank = int(reg_res.group(1).replace('.', ''))
                         name = reg_res.group(2).strip()
                         bsr_dct['cat_1_rank'] = rank
                         bsr_dct['cat_1_name'] = name
-                    cat_li_ls = tr.xpath("./td[@class='value']/ul[@class='zg_hrsr']/li[@class='zg_hrsr_item']")
+                    cat_li_ls = self.xpath('value_zg_hrsr_item', tr)
                     for li in cat_li_ls:
-                        reg_res = re.search(r'n°([\d.]+)',''.join(li.xpath("./span[@class='zg_hrsr_rank']/text()")))
+                        reg_res = re.search(r'n°([\d.]+)',''.join(self.xpath('zg_hrsr_rank', li)))
                         rank = int(reg_res.group(1).replace('.', '').strip()) if reg_res else None
-                        name_ls = li.xpath("./span[@class='zg_hrsr_ladder']//a/text()")
+                        name_ls = self.xpath('zg_hrsr_ladder', li)
                         bsr_dct['cat_ls'].append({"rank": rank, "name_ls": name_ls})
                 else:
-                    name = ''.join(tr.xpath("./td[@class='label']/text()")).replace(":", "").strip().lower()
-                    text = ''.join(tr.xpath("./td[@class='value']/text()")).strip()
+                    name = ''.join(self.xpath('label_text', tr)).replace(":", "").strip().lower()
+                    text = ''.join(self.xpath('value_text', tr)).strip()
                     if 'dimensions du produit' in name:
                         product_info_dct['product_dimensions'] = text
                     elif "poids de l'article" == name:
@@ -188,14 +188,14 @@ class AMZFRProductInfo(AMZProductInfo):
                         product_info_dct[name] = text
         elif tr_ls2:
             for tr in tr_ls2:
-                k_ls = tr.xpath("./th/text()")
+                k_ls = self.xpath('th_text', tr)
                 if not k_ls:
                     continue
                 k = k_ls[0].replace(":", "").strip().lower()
                 if 'best sellers rank' in k:
-                    span_ls = tr.xpath("./td/span/span")
+                    span_ls = self.xpath('td_span_span', tr)
                     if len(span_ls):
-                        text = span_ls[0].xpath("./text()")[0]
+                        text = self.xpath('text', span_ls[0])[0]
                         reg_res = re.search(r'([\d.]+)\s+en\s+(.+)\(', text)
                         if reg_res:
                             rank = int(reg_res.group(1).replace('.', ''))
@@ -204,14 +204,14 @@ class AMZFRProductInfo(AMZProductInfo):
                             bsr_dct['cat_1_name'] = name
                     span_ls = span_ls[1:]
                     for span in span_ls:
-                        text = ' '.join(span.xpath("./text()")).strip()
+                        text = ' '.join(self.xpath('text', span)).strip()
                         reg_res = re.search(r'n°([\d.]+)', text)
                         rank = int(reg_res.group(1).replace('.', '').strip()) if reg_res else None
-                        name_ls = span.xpath(".//a/text()")
+                        name_ls = self.xpath('link_text', span)
                         bsr_dct['cat_ls'].append({"rank": rank, "name_ls": name_ls})
                 else:
                     name = k
-                    text = ''.join(tr.xpath("./td/text()")).strip()
+                    text = ''.join(self.xpath('td_text', tr)).strip()
                     if 'dimensions du produit' in name:
                         product_info_dct['product_dimensions'] = text
                     elif "poids de l'article" == name:
@@ -2,7 +2,7 @@ import json
 import pipeflow
 from error import RequestError, CaptchaError
 from util.log import logger
-from util.chrequest import get_page_handle, change_ip
+from util.chrequest import get_page_handle, change_ip, session_manager
 from util.task_protocal import TaskProtocal
 from .spiders.dispatch import get_spider_by_platform, get_url_by_platform
 
@@ -96,6 +96,8 @@ async def handle_worker(group, task):
 
 
 def run():
+    # every worker may fetch from the same amazon host at once
+    session_manager.set_limits(limit_per_host=MAX_WORKERS)
     routine_input_end = pipeflow.RedisInputEndpoint('amz_product:routine_input', host='192.168.0.10', port=6379, db=0, password=None)
     b_routine_input_end = pipeflow.RedisOutputEndpoint('amz_product:routine_input', host='192.168.0.10', port=6379, db=0, password=None)
     input_end = pipeflow.RedisInputEndpoint('amz_product:input', host='192.168.0.10', port=6379, db=0, password=None)
@@ -9,13 +9,31 @@ from util.log import logger
 from util.prrequest import GetPageSession
 from .spiders.dispatch import get_spider_by_platform, get_url_by_platform
 from util.task_protocal import TaskProtocal
+from util.parse_executor import ParseExecutor
+from util.watermark import WatermarkStore
 from pipeflow import RabbitmqInputEndpoint, RabbitmqOutputEndpoint
-from config import RABBITMQ_CONF
+from config import RABBITMQ_CONF, WATERMARK_PATH
 
 
 MAX_WORKERS = 30
+# parse pages in a pool of processes, 0 means parse on the event loop
+PARSE_WORKERS = 0
 
 task_count = 0
+parse_executor = ParseExecutor([__name__])
+watermark_store = WatermarkStore(WATERMARK_PATH, 'qa')
+
+
+def parse_page(platform, html):
+    """Extract next page and qas from page html, None if it isn't a qa page
+
+    Run by parse_executor, so it only takes and returns picklable objects.
+    """
+    soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
+    handle = get_spider_by_platform(platform)(soup)
+    if not handle.is_qa_page():
+        return None
+    return handle.get_info()
 
 
 async def handle_worker(group, task):
@@ -28,7 +46,9 @@ async def handle_worker(group, task):
                 "asin": "xxxx",
                 "till": "qa id",
                 "page": 1,
+                "mark": "newest qa id",
             }
+        mark is the first qa id of page 1, stored as watermark at the end
     [output] result data format:
         JSON:
             {
@@ -51,7 +71,6 @@ async def handle_worker(group, task):
 
     tp = TaskProtocal(task)
     task_dct = tp.get_data()
-    handle_cls = get_spider_by_platform(task_dct['platform'])
     notify_task = pipeflow.Task(b'task done')
     notify_task.set_to('notify')
     url = get_url_by_platform(task_dct['platform'], task_dct['asin'], task_dct['page'])
@@ -60,8 +79,6 @@ async def handle_worker(group, task):
         try:
             #sess = GetPageSession()
             html = await sess.get_page('get', url, timeout=60, captcha_bypass=True)
-            soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
-            handle = handle_cls(soup)
         except BannedError as exc:
             tp.set_to('input_back')
             ban_tp = tp.new_task({'proxy': exc.proxy[7:]})
@@ -80,21 +97,22 @@ async def handle_worker(group, task):
             exc.__traceback__ = None
             return notify_task
 
-    is_qa_page = handle.is_qa_page()
-    # abandon result
-    if not is_qa_page:
-        return notify_task
-
     try:
-        next_page, qa_ls = handle.get_info()
+        page = await parse_executor.run(parse_page, task_dct['platform'], html)
     except Exception as exc:
         exc_info = (type(exc), exc, exc.__traceback__)
         taks_info = ' '.join([task_dct['platform'], url])
         logger.error('Get page info error\n'+taks_info, exc_info=exc_info)
         exc.__traceback__ = None
         return notify_task
+    # abandon result
+    if page is None:
+        return notify_task
+    next_page, qa_ls = page
 
     qa_id_ls = [item['qa_id'] for item in qa_ls]
+    if current_page == 1 and qa_id_ls:
+        task_dct['mark'] = qa_id_ls[0]
     if 'till' in task_dct and task_dct['till'] in qa_id_ls:
         next_page = None
         i = qa_id_ls.index(task_dct['till'])
@@ -107,6 +125,7 @@ async def handle_worker(group, task):
         new_tp.set_to('inner_output')
         task_ls.append(new_tp)
     else:
+        watermark_store.set(task_dct['platform'], task_dct['asin'], task_dct.get('mark'))
         task_ls.append(notify_task)
     if qa_ls:
         info = {
@@ -132,6 +151,7 @@ async def handle_task(group, task):
                 "asin": "xxxx",
                 "till": "qa id",
             }
+        without till, the watermark of the asin is used
     [notify] task data format:
         BYTES:
             b"task done"
@@ -149,6 +169,10 @@ async def handle_task(group, task):
             if task_count >= MAX_WORKERS:
                 group.suspend_endpoint('input')
             task_dct = tp.get_data()
+            if 'till' not in task_dct:
+                till = watermark_store.get(task_dct['platform'], task_dct['asin'])
+                if till:
+                    task_dct['till'] = till
             logger.info("%s %s %s" % (task_dct['platform'], task_dct['asin'],
                                       task_dct.get('till', '')))
             task_dct["page"] = 1
@@ -164,6 +188,7 @@ async def handle_task(group, task):
 
 
 def run():
+    parse_executor.start(PARSE_WORKERS)
     input_end = RabbitmqInputEndpoint('amz_qa:input', **RABBITMQ_CONF)
     output_end = RabbitmqOutputEndpoint(['amz_qa:input', 'amz_qa:output',
                                          'amz_ip_ban:input'], **RABBITMQ_CONF)
@@ -2,21 +2,154 @@ import re
 import json
 import time
 import asyncio
+import itertools
 import pipeflow
 from lxml import etree
 from urllib import parse
 from error import RequestError, CaptchaError, BannedError
 from util.log import logger
 from util.prrequest import GetPageSession
-from .spiders.dispatch import get_spider_by_platform, get_url_by_platform, formalize_url
+from .spiders.dispatch import get_spider_by_platform, get_url_by_platform, formalize_url, get_page_url
 from util.task_protocal import TaskProtocal
+from util.parse_executor import ParseExecutor
+from util.watermark import WatermarkStore
 from pipeflow import RabbitmqInputEndpoint, RabbitmqOutputEndpoint
-from config import RABBITMQ_CONF
+from config import RABBITMQ_CONF, WATERMARK_PATH
 
 
 MAX_WORKERS = 30
+# parse pages in a pool of processes, 0 means parse on the event loop
+PARSE_WORKERS = 0
+# pages of one asin fetched at once after its first page, 1 means page by page
+FANOUT_PAGES = 5
+# times a fan-out page which failed or isn't the page asked for is fetched
+# again, then its asin is given up there
+FANOUT_RETRIES = 3
 
 task_count = 0
+parse_executor = ParseExecutor([__name__])
+watermark_store = WatermarkStore(WATERMARK_PATH, 'review')
+fanout_id = itertools.count()
+fanout_map = {}
+
+
+class ReviewFanout(object):
+    """Pages 2..last_page of one asin, fetched concurrently and emitted in order
+
+    At most FANOUT_PAGES pages past the last emitted one are running or
+    waiting for an earlier page, the asin's notify goes out once it has
+    ended and none of its pages is running. failed_pages are the pages
+    abandoned, the watermark is only stored if none of them is up to the end.
+    """
+    def __init__(self, last_page):
+        self.last_page = last_page
+        self.next_page = 2
+        self.emit_page = 2
+        self.running = 0
+        self.end = False
+        self.page_map = {}
+        self.failed_pages = set()
+
+
+def parse_page(platform, html):
+    """Extract page info and reviews from page html, None if it isn't a review page
+
+    Run by parse_executor, so it only takes and returns picklable objects.
+    """
+    soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
+    handle = get_spider_by_platform(platform)(soup)
+    if not handle.is_review_page():
+        return None
+    return handle.get_info()
+
+
+def review_output(tp, task_dct, page, review_ls, end):
+    for item in review_ls:
+        if not item['asin']:
+            item['asin'] = task_dct['asin']
+    info = {
+        'platform': task_dct['platform'], 'asin': task_dct['asin'],
+        'page': page,
+        'reviews': review_ls
+    }
+    if end:
+        info['end'] = True
+    new_tp = tp.new_task(info)
+    new_tp.set_to('output')
+    return new_tp
+
+
+def fanout_tasks(tp, task_dct, fanout):
+    """Enqueue the next pages of an asin, up to FANOUT_PAGES ahead of the emitted ones
+    """
+    task_ls = []
+    while not fanout.end and fanout.next_page <= fanout.last_page \
+            and fanout.next_page < fanout.emit_page + FANOUT_PAGES:
+        dct = dict(task_dct)
+        dct['url'] = get_page_url(task_dct['url'], fanout.next_page)
+        dct['page'] = fanout.next_page
+        dct.pop('retry', None)
+        new_tp = tp.new_task(dct)
+        new_tp.set_to('inner_output')
+        task_ls.append(new_tp)
+        fanout.next_page += 1
+        fanout.running += 1
+    return task_ls
+
+
+def fanout_retry(tp, task_dct, url=None):
+    """Fetch a fan-out page again, abandon it after FANOUT_RETRIES"""
+    retry = task_dct.get('retry', 0)
+    if retry >= FANOUT_RETRIES:
+        return fanout_page(tp, task_dct, None)
+    task_dct['retry'] = retry + 1
+    if url:
+        task_dct['url'] = url
+    new_tp = tp.new_task(task_dct)
+    new_tp.set_to('inner_output')
+    return new_tp
+
+
+def fanout_page(tp, task_dct, review_ls):
+    """Collect a fan-out page, emit the pages now in order and enqueue the next ones
+
+    review_ls is None if the page is abandoned, the asin then ends once the
+    pages before it are emitted, like the walk page by page stopped at a
+    failed page: without end and without the watermark.
+    """
+    fanout = fanout_map[task_dct['fanout']]
+    fanout.running -= 1
+    if review_ls is None:
+        fanout.failed_pages.add(task_dct['page'])
+    else:
+        fanout.page_map[task_dct['page']] = review_ls
+    task_ls = []
+    while not fanout.end:
+        page = fanout.emit_page
+        if page in fanout.failed_pages:
+            fanout.end = True
+            break
+        if page not in fanout.page_map:
+            break
+        review_ls = fanout.page_map.pop(page)
+        review_id_ls = [item['review_id'] for item in review_ls]
+        if 'till' in task_dct and task_dct['till'] in review_id_ls:
+            review_ls = review_ls[:review_id_ls.index(task_dct['till'])]
+            fanout.end = True
+        if page == fanout.last_page:
+            fanout.end = True
+        if fanout.end and not any(p <= page for p in fanout.failed_pages):
+            watermark_store.set(task_dct['platform'], task_dct['asin'], task_dct.get('mark'))
+        fanout.emit_page += 1
+        if review_ls or fanout.end:
+            task_ls.append(review_output(tp, task_dct, page, review_ls, fanout.end))
+    task_ls.extend(fanout_tasks(tp, task_dct, fanout))
+    if fanout.end and not fanout.running:
+        del fanout_map[task_dct['fanout']]
+        notify_task = pipeflow.Task(b'task done')
+        notify_task.set_to('notify')
+        task_ls.append(notify_task)
+    return task_ls
 
 
 async def handle_worker(group, task):
@@ -29,7 +162,13 @@ async def handle_worker(group, task):
                 "asin": "xxxx",
                 "till": "reveiw id",
                 "url": "xxxx",
+                "mark": "newest review id",
+                "fanout": 1,
+                "page": 2,
+                "retry": 1,
             }
+        fanout, page and retry are only set on the pages fetched concurrently,
+        mark is the first review id of page 1, stored as watermark at the end
     [output] result data format:
         JSON:
             {
@@ -55,9 +194,9 @@ async def handle_worker(group, task):
 
     tp = TaskProtocal(task)
     task_dct = tp.get_data()
-    handle_cls = get_spider_by_platform(task_dct['platform'])
     notify_task = pipeflow.Task(b'task done')
     notify_task.set_to('notify')
+    is_fanout = 'fanout' in task_dct
     url = task_dct['url']
     if not url:
         url = get_url_by_platform(task_dct['platform'], task_dct['asin'])
@@ -65,10 +204,9 @@ async def handle_worker(group, task):
         try:
             #sess = GetPageSession()
             html = await sess.get_page('get', url, timeout=60, captcha_bypass=True)
-            soup = etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8'))
-            handle = handle_cls(soup)
         except BannedError as exc:
-            tp.set_to('input_back')
+            # a fan-out page is retried here, its asin is already running
+            tp.set_to('inner_output' if is_fanout else 'input_back')
             ban_tp = tp.new_task({'proxy': exc.proxy[7:]})
             ban_tp.set_to('ban')
             return [ban_tp, tp]
@@ -83,21 +221,20 @@ async def handle_worker(group, task):
             taks_info = ' '.join([task_dct['platform'], url])
             logger.error('Get page handle error\n'+taks_info, exc_info=exc_info)
             exc.__traceback__ = None
-            return notify_task
-
-    is_review_page = handle.is_review_page()
-    # abandon result
-    if not is_review_page:
-        return notify_task
+            return fanout_retry(tp, task_dct) if is_fanout else notify_task
 
     try:
-        page_info, review_ls = handle.get_info()
+        page = await parse_executor.run(parse_page, task_dct['platform'], html)
     except Exception as exc:
         exc_info = (type(exc), exc, exc.__traceback__)
         taks_info = ' '.join([task_dct['platform'], url])
         logger.error('Get page info error\n'+taks_info, exc_info=exc_info)
         exc.__traceback__ = None
-        return notify_task
+        return fanout_retry(tp, task_dct) if is_fanout else notify_task
+    # abandon result
+    if page is None:
+        return fanout_retry(tp, task_dct) if is_fanout else notify_task
+    page_info, review_ls = page
 
     ### just for redirect response situation
     if page_info['cur_page_url']:
@@ -105,41 +242,48 @@ async def handle_worker(group, task):
         query_dct = dict(parse.parse_qsl(pr.query))
         if 'reviewerType' not in query_dct or 'pageSize' not in query_dct or 'sortBy' not in query_dct:
             new_url = get_url_by_platform(task_dct['platform'], task_dct['asin'], pr.path)
+            if is_fanout:
+                return fanout_retry(tp, task_dct, get_page_url(new_url, task_dct['page']))
             task_dct['url'] = new_url
             new_tp = tp.new_task(task_dct)
             new_tp.set_to('inner_output')
             return new_tp
+    if is_fanout:
+        # redirected to another page, its reviews would take the place of this one's
+        if page_info['cur_page'] != task_dct['page']:
+            return fanout_retry(tp, task_dct)
+        return fanout_page(tp, task_dct, review_ls)
 
     if page_info['next_page_url']:
         page_info['next_page_url'] = formalize_url(task_dct['platform'], page_info['next_page_url'])
     review_id_ls = [item['review_id'] for item in review_ls]
+    if page_info['cur_page'] == 1 and review_id_ls:
+        task_dct['mark'] = review_id_ls[0]
     if 'till' in task_dct and task_dct['till'] in review_id_ls:
         page_info['next_page_url'] = None
         i = review_id_ls.index(task_dct['till'])
         review_ls = review_ls[:i]
 
     task_ls = []
-    if page_info['next_page_url']:
+    if review_ls:
+        task_ls.append(review_output(tp, task_dct, page_info['cur_page'], review_ls,
+                                     not page_info['next_page_url']))
+    if page_info['next_page_url'] and FANOUT_PAGES > 1 and page_info['cur_page'] == 1 \
+            and page_info['last_page'] > 1:
+        # the page count is known, fetch the rest of the pages concurrently
+        task_dct['url'] = page_info['next_page_url']
+        task_dct['fanout'] = next(fanout_id)
+        fanout = ReviewFanout(page_info['last_page'])
+        fanout_map[task_dct['fanout']] = fanout
+        task_ls.extend(fanout_tasks(tp, task_dct, fanout))
+    elif page_info['next_page_url']:
         task_dct['url'] = page_info['next_page_url']
         new_tp = tp.new_task(task_dct)
         new_tp.set_to('inner_output')
         task_ls.append(new_tp)
     else:
+        watermark_store.set(task_dct['platform'], task_dct['asin'], task_dct.get('mark'))
         task_ls.append(notify_task)
-    if review_ls:
-        for item in review_ls:
-            if not item['asin']:
-                item['asin'] = task_dct['asin']
-        info = {
-            'platform': task_dct['platform'], 'asin': task_dct['asin'],
-            'page': page_info['cur_page'],
-            'reviews': review_ls
-        }
-        if not page_info['next_page_url']:
-            info['end'] = True
-        new_tp = tp.new_task(info)
-        new_tp.set_to('output')
-        task_ls.append(new_tp)
     return task_ls
 
 
@@ -153,6 +297,7 @@ async def handle_task(group, task):
                 "asin": "xxxx",
                 "till": "reveiw id",
             }
+        without till, the watermark of the asin is used
     [notify] task data format:
         BYTES:
             b"task done"
@@ -170,6 +315,10 @@ async def handle_task(group, task):
             if task_count >= MAX_WORKERS:
                 group.suspend_endpoint('input')
             task_dct = tp.get_data()
+            if 'till' not in task_dct:
+                till = watermark_store.get(task_dct['platform'], task_dct['asin'])
+                if till:
+                    task_dct['till'] = till
             logger.info("%s %s %s" % (task_dct['platform'], task_dct['asin'],
                                       task_dct.get('till', '')))
             task_dct["url"] = ""
@@ -185,6 +334,7 @@ async def handle_task(group, task):
 
 
 def run():
+    parse_executor.start(PARSE_WORKERS)
     input_end = RabbitmqInputEndpoint('amz_review:input', **RABBITMQ_CONF)
     output_end = RabbitmqOutputEndpoint(['amz_review:input', 'amz_review:output',
                                          'amz_ip_ban:input'], **RABBITMQ_CONF)
@@ -43,6 +43,7 @@ class AMZESReviewInfo(object):
             "cur_page": 1,
             "cur_page_url": None,
             "next_page_url": None,
+            "last_page": 1,
         }
         btn_ls = self.soup.xpath("//div[@id='cm_cr-pagination_bar']//li[@data-reftag='cm_cr_arp_d_paging_btm']")
         selected_index = None
@@ -50,6 +51,10 @@ class AMZESReviewInfo(object):
             if 'a-selected' in ' '.join(btn_ls[i].xpath("./@class")):
                 selected_index = i
                 break
+        for btn in btn_ls:
+            page = ''.join(btn.xpath("./a/text()")).strip()
+            if page.isdigit():
+                info['last_page'] = max(info['last_page'], int(page))
         if selected_index is not None:
             page = btn_ls[selected_index].xpath("./a/text()")
             url = ''.join(btn_ls[selected_index].xpath("./a/@href"))
@@ -57,3 +57,9 @@ def get_url_by_platform(platform, asin, path=None):
     else:
         return "https://{domain}/product-reviews/{asin}?reviewerType=all_reviews&pageSize=50&sortBy=recent".format(
                 domain=domain, asin=asin)
+
+def get_page_url(url, page):
+    pr = parse.urlparse(url)
+    query_dct = dict(parse.parse_qsl(pr.query))
+    query_dct['pageNumber'] = str(page)
+    return parse.urlunparse(pr._replace(query=parse.urlencode(query_dct)))
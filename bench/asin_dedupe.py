@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Compare memory and speed of AsinSet with a python set of asins.
+
+    python -m bench.asin_dedupe -n 1000000
+"""
+import time
+import random
+import argparse
+import tracemalloc
+from util.packed_set import PackedSet, pack_asin, to_asin
+
+
+class AsinSet(PackedSet):
+    """PackedSet of asins, an asin is 10 chars of [0-9A-Z] so it packs into
+    one slot as a base 36 int. Anything else falls back to a python set.
+    """
+    def __init__(self, capacity=1024):
+        super(AsinSet, self).__init__(capacity)
+        self._other_set = set([])
+
+    def __len__(self):
+        return self._len + len(self._other_set)
+
+    def __contains__(self, asin):
+        value = pack_asin(asin)
+        if value is not None:
+            return PackedSet.__contains__(self, value)
+        return asin in self._other_set
+
+    def __iter__(self):
+        for value in PackedSet.__iter__(self):
+            yield to_asin(value)
+        for asin in self._other_set:
+            yield asin
+
+    def add(self, asin):
+        value = pack_asin(asin)
+        if value is not None:
+            PackedSet.add(self, value)
+        else:
+            self._other_set.add(asin)
+
+    def discard(self, asin):
+        value = pack_asin(asin)
+        if value is not None:
+            PackedSet.discard(self, value)
+        else:
+            self._other_set.discard(asin)
+
+
+def random_asin_ls(count):
+    chars = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return ['B0' + ''.join(random.choice(chars) for _ in range(8)) for _ in range(count)]
+
+
+def fill(factory, asin_ls):
+    dedupe = factory()
+    for asin in asin_ls:
+        # a new string object for each asin, like the ones parsed from pages
+        asin = asin[:5] + asin[5:]
+        if asin not in dedupe:
+            dedupe.add(asin)
+    return dedupe
+
+
+def bench(name, factory, asin_ls, probe_ls):
+    start = time.perf_counter()
+    dedupe = fill(factory, asin_ls)
+    add_time = time.perf_counter() - start
+    start = time.perf_counter()
+    hit = sum(1 for asin in probe_ls if asin in dedupe)
+    probe_time = time.perf_counter() - start
+    del dedupe
+    # measured apart, tracemalloc slows down every allocation
+    tracemalloc.start()
+    dedupe = fill(factory, asin_ls)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("%-8s %8d asins  %7.1f MB  %5.1f bytes/asin  add %5.2f us  lookup %5.2f us  hit %d" % (
+          name, len(dedupe), size/2**20, size/len(dedupe),
+          add_time*1e6/len(asin_ls), probe_time*1e6/len(probe_ls), hit))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark asin dedupe')
+    parser.add_argument('-n', dest='count', type=int, default=1000000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    asin_ls = random_asin_ls(args.count)
+    # as in a run, an asin shows up in a few categories
+    asin_ls += random.sample(asin_ls, args.count//2)
+    probe_ls = [asin[:5] + asin[5:] for asin in random.sample(asin_ls, min(args.count, 200000))]
+    probe_ls += random_asin_ls(len(probe_ls))
+    bench('set', set, asin_ls, probe_ls)
+    bench('AsinSet', AsinSet, asin_ls, probe_ls)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""Benchmark AMZProductInfo.get_info with the precompiled XPath registry
+against evaluating the same expression strings on every call.
+
+    python -m bench.product_xpath -p amazon_us page1.html page2.html
+"""
+import time
+import argparse
+from lxml import etree
+from amz_product.spiders.dispatch import get_spider_by_platform
+
+
+def legacy_cls(handle_cls):
+    class LegacyXPath(handle_cls):
+        def xpath(self, name, node=None):
+            node = self.soup if node is None else node
+            return node.xpath(self._xpath_registry[name].path)
+    return LegacyXPath
+
+
+def bench(handle_cls, html_ls, rounds):
+    soup_ls = [etree.HTML(html, parser=etree.HTMLParser(encoding='utf-8')) for html in html_ls]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for soup in soup_ls:
+            handle_cls(soup).get_info()
+    return (time.perf_counter() - start) / (rounds * len(soup_ls))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark product page extraction')
+    parser.add_argument('-p', '--platform', dest='platform', default='amazon_us')
+    parser.add_argument('-r', '--rounds', dest='rounds', type=int, default=50)
+    parser.add_argument('pages', nargs='+', help='saved product pages')
+    args = parser.parse_args()
+
+    html_ls = []
+    for path in args.pages:
+        with open(path, 'rb') as f:
+            html_ls.append(f.read())
+    handle_cls = get_spider_by_platform(args.platform)
+    before = bench(legacy_cls(handle_cls), html_ls, args.rounds)
+    after = bench(handle_cls, html_ls, args.rounds)
+    print("pages: %d, rounds: %d" % (len(html_ls), args.rounds))
+    print("string xpath:   %.3f ms/page" % (before*1000))
+    print("compiled xpath: %.3f ms/page" % (after*1000))
+    print("speedup:        %.2fx" % (before/after))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Compare size and encode/decode time of the task formats on sample payloads.
+
+    python -m bench.task_envelope -d task.dict samples.jsonl
+
+Samples are json lines, like the ones train_task_dict.py takes.
+"""
+import json
+import zlib
+import time
+import argparse
+from util.task_protocal import JSONEnvelope, MsgpackEnvelope
+from train_task_dict import load_samples
+
+
+def legacy_encode(data):
+    return zlib.compress(json.dumps({'tid': '1', 'i': 0, 'data': data}).encode('utf-8'))
+
+
+def legacy_decode(raw):
+    return json.loads(zlib.decompress(raw).decode('utf-8'))['data']
+
+
+def envelope_codec(envelope):
+    header = {'tid': '1', 'i': 0}
+    encode = lambda data: envelope.pack(header, envelope.encode_body(data))
+    decode = lambda raw: envelope.decode_body(envelope.unpack_header(raw)[1])
+    return encode, decode
+
+
+# int keys, tuples and nesting, every format must give back the json view of it
+CHECK_DATA = {
+    'review_statistics': {1: 6, 2: 0, 5: 94},
+    'nested': [{'1': 'a', 2: ['b', (3, 4)]}, {None: 1, True: 2, 1.5: 3}],
+    'extra': {'cb': {'url': 'http://example.com/cb'}},
+}
+
+
+def check_round_trip(codec_ls):
+    """Every codec decodes CHECK_DATA to what json.loads(json.dumps()) gives"""
+    expected = json.loads(json.dumps(CHECK_DATA))
+    for name, encode, decode in codec_ls:
+        data = decode(encode(CHECK_DATA))
+        assert data == expected, "%s round trip: %r != %r" % (name, data, expected)
+
+
+def bench(encode, decode, data_ls, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        raw_ls = [encode(data) for data in data_ls]
+    encode_time = (time.perf_counter() - start) / (rounds * len(data_ls))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for raw in raw_ls:
+            decode(raw)
+    decode_time = (time.perf_counter() - start) / (rounds * len(data_ls))
+    size = sum(len(raw) for raw in raw_ls) / len(raw_ls)
+    return size, encode_time, decode_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark task formats')
+    parser.add_argument('-d', '--dict', dest='dict_ls', action='append', default=[],
+                        help='zstd dictionary for format 2')
+    parser.add_argument('-r', '--rounds', dest='rounds', type=int, default=20)
+    parser.add_argument('samples', nargs='+', help='json lines sample files')
+    args = parser.parse_args()
+
+    import msgpack
+    data_ls = [msgpack.unpackb(raw, raw=False, strict_map_key=False) for raw in load_samples(args.samples)]
+    codec_ls = [
+        ('legacy zlib/json', legacy_encode, legacy_decode),
+        ('v1 json+zlib', ) + envelope_codec(JSONEnvelope()),
+        ('v2 msgpack+zstd', ) + envelope_codec(MsgpackEnvelope()),
+    ]
+    if args.dict_ls:
+        codec_ls.append(('v2 msgpack+zstd+dict', ) + envelope_codec(MsgpackEnvelope(args.dict_ls)))
+    check_round_trip(codec_ls)
+    raw_size = sum(len(json.dumps(data)) for data in data_ls) / len(data_ls)
+    print("samples: %d, avg json size: %.0f bytes" % (len(data_ls), raw_size))
+    for name, encode, decode in codec_ls:
+        size, encode_time, decode_time = bench(encode, decode, data_ls, args.rounds)
+        print("%-22s size %7.0f bytes  encode %7.1f us  decode %7.1f us" %
+              (name, size, encode_time*1e6, decode_time*1e6))
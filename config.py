@@ -1,3 +1,9 @@
+import os
+
+
+# local files are kept in the project directory, start_crawler.py -d chdirs to /
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 RABBITMQ_CONF = {
     'host': '192.168.0.10',
     'port': 5672,
@@ -20,3 +26,20 @@ BSR_REDIS_CONF = {
     'db': 5,
     'password': None
 }
+
+# format of the tasks written by TaskProtocal, all of them are readable:
+# 0 legacy zlib/json, 1 json header + zlib/json body, 2 msgpack header + zstd/msgpack body
+# keep 0 until every reader of the queues (external consumers included) is upgraded
+TASK_FORMAT = 0
+# format of the tasks sent to an output, overriding TASK_FORMAT, by the name
+# given to set_to. flow_core sends to the queues by their names, so a queue
+# moves to a new format once its readers are upgraded, e.g. {'amz_review:input': 2}
+TASK_QUEUE_FORMAT = {}
+# zstd dictionaries of format 2, the first one compresses, all of them decompress
+TASK_ZSTD_DICT_LS = []
+
+# sqlite file of the newest review/qa id crawled per asin, the default till
+# of review and qa tasks, empty to always crawl every page
+WATERMARK_PATH = os.path.join(BASE_DIR, 'watermark.db')
+# sqlite file of the bsr category trees, empty to always walk the whole tree
+BSR_TREE_PATH = os.path.join(BASE_DIR, 'bsr_tree.db')
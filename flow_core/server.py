@@ -6,13 +6,15 @@ import asyncio
 import pipeflow
 from util.log import logger
 from util.task_protocal import TaskProtocal
-from config import REDIS_CONF
+from config import REDIS_CONF, RABBITMQ_CONF
 
 
 FLOW_TASK_CONF = "task_conf"
 FLOW_NODE_CONF = "node_conf"
 MAX_WORKERS = 3
 REFRESH_INTERVAL = 120
+# hops of the routed tasks are sent to statistic:input in one task per interval
+HOP_REPORT_INTERVAL = 1
 
 flow_conf = {}
 conf = {
@@ -27,6 +29,35 @@ conf = {
 }
 conf.update(REDIS_CONF)
 redis_client = redis.Redis(**conf)
+hop_ls = []
+# ticks of report_timer for the report group
+report_queue = asyncio.Queue()
+
+
+def gather_hops(tp):
+    """Keep the hops of a routed task until the next report"""
+    tid = tp.get_tid()
+    for endpoint, step, queue_ms, work_ms in tp.get_hops():
+        hop_ls.append([tid, step, endpoint, queue_ms, work_ms])
+
+
+async def report_timer(server):
+    """Tick the report group every interval, whether tasks come in or not"""
+    while True:
+        await asyncio.sleep(HOP_REPORT_INTERVAL)
+        if hop_ls and report_queue.empty():
+            report_queue.put_nowait(pipeflow.Task(b'report'))
+
+
+async def handle_report(group, task):
+    """Send the gathered hops to statistic:input in one task"""
+    global hop_ls
+    if not hop_ls:
+        return
+    stats_tp = TaskProtocal({'tid': 'stats', 'i': 0, 'data': {'hops': hop_ls}})
+    stats_tp.set_to('statistic')
+    hop_ls = []
+    return stats_tp
 
 
 async def handle_worker(group, task):
@@ -40,17 +71,16 @@ async def handle_worker(group, task):
         logger.error("Task ID [%s] error" % tid)
         return
     task_ls = []
-    task_data = tp.get_data()
+    # the routed tasks restart their hops from here
     if step+1 < len(flow_conf[FLOW_TASK_CONF][tid]):
         endpoint_name = flow_conf[FLOW_TASK_CONF][tid][step+1]['name']
-        next_tp = tp.new_task(task_data, next_step=True)
-        next_tp.set_to(endpoint_name)
+        next_tp = tp.forward(next_step=True, reset_hops=True, to=endpoint_name)
         task_ls.append(next_tp)
     for f_tid in flow_conf[FLOW_TASK_CONF][tid][step].get('fork', []):
         endpoint_name = flow_conf[FLOW_TASK_CONF][f_tid][0]['name']
-        fork_tp = tp.new_task(task_data, tid=f_tid)
-        fork_tp.set_to(endpoint_name)
+        fork_tp = tp.forward(tid=f_tid, reset_hops=True, to=endpoint_name)
         task_ls.append(fork_tp)
+    gather_hops(tp)
     return task_ls
 
 
@@ -117,6 +147,12 @@ def run():
     refresh_conf()
     server = pipeflow.Server()
     server.add_worker(refresh_routine)
+    server.add_worker(report_timer)
+    group = server.add_group('report', 1)
+    group.add_input_endpoint('tick', pipeflow.QueueInputEndpoint(report_queue))
+    stats_end = pipeflow.RabbitmqOutputEndpoint(['statistic:input'], **RABBITMQ_CONF)
+    group.add_output_endpoint('statistic', stats_end, 'statistic:input')
+    group.set_handle(handle_report)
     group = server.add_group('main', MAX_WORKERS)
     for i in range(len(flow_conf['merge_ls'])):
         conf = flow_conf['merge_ls'][i]
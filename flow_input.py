@@ -9,6 +9,9 @@ import threading
 from .config import REDIS_CONF
 
 
+WINDOW_SIZE = 500
+
+
 PY3 = sys.version_info > (3,)
 b_to_str = lambda x:x.decode('utf-8') if PY3 else x
 str_to_b = lambda x:x.encode('utf-8') if PY3 else x
@@ -61,6 +64,19 @@ class FlowInput(object):
                                                         for k,v in rabbitmq_conf_dct.items()])
                     redis_client.connection_pool.disconnect()
 
+    def reconnect(self):
+        print("[flow input]=====connection closed=====")
+        self._local.tx_channel = None
+        if not self._local.connection.is_closed:
+            self._local.connection.close()
+        try:
+            self._local.connection = pika.BlockingConnection(self._local.parameters)
+            self._local.channel = self._local.connection.channel()
+            self._local.channel.confirm_delivery()
+        except:
+            print("[flow input]=====reconnect error=====")
+            pass
+
     def send_task(self, task_type, task_data):
         """Send task data
 
@@ -97,16 +113,7 @@ class FlowInput(object):
                 res = self._local.channel.basic_publish(exchange='', routing_key=queue_name,
                         body=zlib.compress(str_to_b(json.dumps(task_dct))))
             except (pika.exceptions.ChannelClosed, pika.exceptions.ConnectionClosed):
-                print("[flow input]=====connection closed=====")
-                if not self._local.connection.is_closed:
-                    self._local.connection.close()
-                try:
-                    self._local.connection = pika.BlockingConnection(self._local.parameters)
-                    self._local.channel = self._local.connection.channel()
-                    self._local.channel.confirm_delivery()
-                except:
-                    print("[flow input]=====reconnect error=====")
-                    pass
+                self.reconnect()
             else:
                 break
         if res:
@@ -116,3 +123,71 @@ class FlowInput(object):
             except (pika.exceptions.ChannelClosed, pika.exceptions.ConnectionClosed):
                 pass
         return res
+
+    def send_tasks(self, task_type, task_data_iter, window_size=WINDOW_SIZE):
+        """Send a stream of task data
+
+        Tasks are published in windows of window_size on a transactional
+        channel, a window costs one round trip for its commit instead of one
+        confirm per task, and carries one statistic message with its count.
+        A window that fails is sent again as a whole, up to 3 times. Delivery
+        is at least once: if the connection drops after the commit went out
+        but before its ok came back, the window is committed twice, so
+        consumers may see its tasks again.
+
+        return the number of tasks sent, they are sent in order, so on failure
+        the first ones of task_data_iter are sent and the rest aren't
+        """
+        assert task_type in self.task_conf_dct, "task_type isn't supported"
+        queue_name = self.task_conf_dct[task_type][0]['name']
+        count = 0
+        body_ls = []
+        for task_data in task_data_iter:
+            assert isinstance(task_data, dict), "task_data isn't a dictionary"
+            task_dct = {
+                "tid": task_type,
+                "i": 0,
+                "data": task_data
+            }
+            body_ls.append(zlib.compress(str_to_b(json.dumps(task_dct))))
+            if len(body_ls) >= window_size:
+                if not self._send_window(task_type, queue_name, body_ls):
+                    return count
+                count += len(body_ls)
+                body_ls = []
+        if body_ls and self._send_window(task_type, queue_name, body_ls):
+            count += len(body_ls)
+        return count
+
+    def _send_window(self, task_type, queue_name, body_ls):
+        statistic_dct = {
+            "tid": 'stats',
+            "i": 0,
+            "data": {
+                'extra': {
+                    'stats': {
+                        'tid': task_type,
+                        'step': 0,
+                        'count': len(body_ls)
+                    }
+                }
+            }
+        }
+        statistic_body = zlib.compress(str_to_b(json.dumps(statistic_dct)))
+        retry = 3
+        while retry > 0:
+            retry -= 1
+            try:
+                if getattr(self._local, "tx_channel", None) is None:
+                    self._local.tx_channel = self._local.connection.channel()
+                    self._local.tx_channel.tx_select()
+                channel = self._local.tx_channel
+                for body in body_ls:
+                    channel.basic_publish(exchange='', routing_key=queue_name, body=body)
+                channel.basic_publish(exchange='', routing_key='statistic:input', body=statistic_body)
+                channel.tx_commit()
+            except (pika.exceptions.ChannelClosed, pika.exceptions.ConnectionClosed):
+                self.reconnect()
+            else:
+                return True
+        return False
@@ -2,38 +2,131 @@ import json
 import zlib
 import asyncio
 import aiohttp
+from urllib import parse
 import pipeflow
 from util.log import logger
+from util.chrequest import SessionManager
 from util.task_protocal import TaskProtocal
-from pipeflow import RabbitmqInputEndpoint, RabbitmqOutputEndpoint
+from util.rabbitmq_endpoints import RabbitmqInputEndpoint, RabbitmqOutputEndpoint
 from config import RABBITMQ_CONF
 
 
-MAX_WORKERS = 15
+MAX_WORKERS = 200
+# timeouts of the connect and of each read, the wait for a free pooled
+# connection isn't limited, a post is only given up on the receiver
 TIME_OUT = 10
+CONN_TIMEOUT = 7
+# one session for all the callbacks, a customer url gets at most
+# CONN_LIMIT_PER_HOST connections whatever the number of workers
+CONN_LIMIT = 100
+CONN_LIMIT_PER_HOST = 8
+# workers a host may hold, the tasks of a host beyond them are sent back to
+# the queue after REQUEUE_DELAY, so a slow host doesn't starve the others
+MAX_WORKERS_PER_HOST = 50
+REQUEUE_DELAY = 1
+# callbacks with "batch" set get the results of the same url in one post of
+# a json list, at most BATCH_SIZE results or BATCH_MAX_BYTES of json, or
+# whatever came within BATCH_LINGER_MS of the first result of the batch
+BATCH_SIZE = 50
+BATCH_MAX_BYTES = 4 * 1024 * 1024
+BATCH_LINGER_MS = 200
+
+session_manager = SessionManager(limit=CONN_LIMIT, limit_per_host=CONN_LIMIT_PER_HOST)
+# host -> workers posting or batching a result for it
+host_worker_map = {}
+
+
+async def post_data(url, data):
+    session = session_manager.get_session()
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONN_TIMEOUT, sock_read=TIME_OUT)
+    try:
+        async with session.post(url, timeout=timeout, data=zlib.compress(data)) as resp:
+            await resp.read()
+            if resp.status != 200:
+                logger.error('[%d] %s' % (resp.status, url))
+    except Exception as exc:
+        logger.error('Request page fail : %s' % exc)
+
+
+class CallbackBatcher(object):
+    """Coalesce the results bound for the same callback url
+
+    add() returns once the batch of the result is posted, so the worker
+    slot is held until then and the number of workers bounds the results
+    waiting in batches.
+    """
+    def __init__(self):
+        self._batch_map = {}
+
+    async def add(self, url, data):
+        batch = self._batch_map.get(url)
+        if batch is not None and batch['size'] + len(data) > BATCH_MAX_BYTES:
+            self._flush(url)
+            batch = None
+        if batch is None:
+            loop = asyncio.get_event_loop()
+            batch = self._batch_map[url] = {
+                'data_ls': [], 'size': 0, 'future': loop.create_future(),
+                'timer': loop.call_later(BATCH_LINGER_MS/1000, self._flush, url),
+            }
+        future = batch['future']
+        batch['data_ls'].append(data)
+        batch['size'] += len(data)
+        if len(batch['data_ls']) >= BATCH_SIZE:
+            self._flush(url)
+        await future
+
+    def _flush(self, url):
+        batch = self._batch_map.pop(url, None)
+        if batch is None:
+            return
+        batch['timer'].cancel()
+        asyncio.ensure_future(self._post(url, batch))
+
+    async def _post(self, url, batch):
+        try:
+            await post_data(url, b'[' + b','.join(batch['data_ls']) + b']')
+        finally:
+            batch['future'].set_result(len(batch['data_ls']))
+
+
+batcher = CallbackBatcher()
 
 
 async def handle_worker(group, task):
     """Handle callback task
+
+    The result is posted to extra.cb.url as zlib compressed json, with
+    extra.cb.batch as a zlib compressed json list of results.
     """
     tp = TaskProtocal(task)
     task_dct = tp.get_data()
     if 'extra' in task_dct and 'cb' in task_dct['extra']:
         url = task_dct['extra']['cb'].get('url')
-        async with aiohttp.ClientSession(conn_timeout=7) as session:
-            try:
-                async with session.post(url, timeout=TIME_OUT, data=zlib.compress(json.dumps(task_dct).encode('utf-8'))) as resp:
-                    html = await resp.read()
-                    if resp.status != 200:
-                        logger.error('[%d] %s' % (resp.status, url))
-            except Exception as exc:
-                logger.error('Request page fail : %s' % exc)
+        host = parse.urlparse(url).netloc if url else ''
+        if host_worker_map.get(host, 0) >= MAX_WORKERS_PER_HOST:
+            await asyncio.sleep(REQUEUE_DELAY)
+            tp.set_to('input_back')
+            return tp
+        host_worker_map[host] = host_worker_map.get(host, 0) + 1
+        try:
+            data = json.dumps(task_dct).encode('utf-8')
+            if task_dct['extra']['cb'].get('batch'):
+                await batcher.add(url, data)
+            else:
+                await post_data(url, data)
+        finally:
+            host_worker_map[host] -= 1
+            if not host_worker_map[host]:
+                del host_worker_map[host]
 
 
 def run():
-    input_end = RabbitmqInputEndpoint('http_callback:input', **RABBITMQ_CONF)
+    input_end = RabbitmqInputEndpoint('http_callback:input', qos=MAX_WORKERS, buffered=True, **RABBITMQ_CONF)
+    output_end = RabbitmqOutputEndpoint(['http_callback:input'], **RABBITMQ_CONF)
     server = pipeflow.Server()
     group = server.add_group('main', MAX_WORKERS)
     group.add_input_endpoint('input', input_end)
+    group.add_output_endpoint('input_back', output_end, 'http_callback:input')
     group.set_handle(handle_worker)
     server.run()
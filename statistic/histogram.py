@@ -0,0 +1,77 @@
+# a power of 2 range is cut in 2**(SUB_BUCKET_BITS-1) buckets
+SUB_BUCKET_BITS = 6
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+
+
+def bucket_index(value):
+    """Bucket of a value, HDR style: values below SUB_BUCKET_COUNT get one bucket
+    each, above it a power of 2 range is cut in SUB_BUCKET_COUNT/2 buckets, so a
+    bucket is at most 1/32 (about 3%) wide relative to its values
+    """
+    if value < SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return (shift << (SUB_BUCKET_BITS-1)) + (value >> shift)
+
+
+def bucket_value(index):
+    """Highest value of a bucket"""
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift, sub = divmod(index, SUB_BUCKET_COUNT >> 1)
+    shift -= 1
+    sub += SUB_BUCKET_COUNT >> 1
+    return ((sub + 1) << shift) - 1
+
+
+class LatencyHistogram(object):
+    """Sparse histogram of ms latencies, {bucket index: count}
+
+    Histograms merge by adding their counts, so minutes can be added up
+    into hours later on.
+    """
+    __slots__ = ('count_map', 'count', 'total', 'max')
+
+    def __init__(self, count_map=None):
+        self.count_map = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        if count_map:
+            for index, count in count_map.items():
+                index = int(index)
+                self.count_map[index] = self.count_map.get(index, 0) + count
+                self.count += count
+                self.total += bucket_value(index) * count
+                self.max = max(self.max, bucket_value(index))
+
+    def record(self, value):
+        value = max(int(value), 0)
+        index = bucket_index(value)
+        self.count_map[index] = self.count_map.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.count_map.items():
+            self.count_map[index] = self.count_map.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """Upper bound of the q percentile, 0 when empty"""
+        if not self.count:
+            return 0
+        rank = max(self.count * q / 100.0, 1)
+        seen = 0
+        for index in sorted(self.count_map):
+            seen += self.count_map[index]
+            if seen >= rank:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
@@ -0,0 +1,29 @@
+-- Schema changes of the statistics database, run them in order on an
+-- existing database before deploying the code which needs them.
+-- statistic/server.py checks the unique keys at startup.
+
+-- counts are added with INSERT ... ON DUPLICATE KEY UPDATE, one row per
+-- (name, day); merge the duplicate rows first if there are any
+ALTER TABLE amz_task_statistic ADD UNIQUE KEY UK_name_time (name, time);
+
+-- per minute latencies of each (tid, step, endpoint), reported by flow_core
+CREATE TABLE IF NOT EXISTS amz_stage_latency (
+    id INT NOT NULL AUTO_INCREMENT,
+    minute TIMESTAMP NOT NULL,
+    tid VARCHAR(32) NOT NULL DEFAULT '',
+    step INT NOT NULL DEFAULT 0,
+    endpoint VARCHAR(128) NOT NULL DEFAULT '',
+    count INT NOT NULL DEFAULT 0,
+    queue_p50 INT NOT NULL DEFAULT 0,
+    queue_p90 INT NOT NULL DEFAULT 0,
+    queue_p99 INT NOT NULL DEFAULT 0,
+    queue_max INT NOT NULL DEFAULT 0,
+    work_p50 INT NOT NULL DEFAULT 0,
+    work_p90 INT NOT NULL DEFAULT 0,
+    work_p99 INT NOT NULL DEFAULT 0,
+    work_max INT NOT NULL DEFAULT 0,
+    queue_hist TEXT NOT NULL,
+    work_hist TEXT NOT NULL,
+    CONSTRAINT PK_id PRIMARY KEY (id),
+    UNIQUE KEY UK_minute_stage (minute, tid, step, endpoint)
+);
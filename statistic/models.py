@@ -1,5 +1,5 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, TEXT, TIMESTAMP, PrimaryKeyConstraint
+from sqlalchemy import Column, Integer, String, TEXT, TIMESTAMP, PrimaryKeyConstraint, UniqueConstraint
 from sqlalchemy.dialects.mysql import SMALLINT, TINYINT, DECIMAL
 Base = declarative_base()
 
@@ -8,8 +8,38 @@ class AMZTaskStatistic(Base):
     __tablename__ = 'amz_task_statistic'
     __table_args__ = (
         PrimaryKeyConstraint('id', name='PK_id'),
+        UniqueConstraint('name', 'time', name='UK_name_time'),
     )
     id = Column(Integer)
     name = Column(String(64), nullable=False, default='')
     count = Column(Integer, nullable=False, default=0)
     time = Column(TIMESTAMP, nullable=False, default='')
+
+
+class AMZStageLatency(Base):
+    """Latencies of the tasks through one (tid, step, endpoint) in one minute
+
+    queue is the time from the previous hop to this one, work the time spent
+    in it, *_hist the json {bucket: count} of statistic.histogram.
+    """
+    __tablename__ = 'amz_stage_latency'
+    __table_args__ = (
+        PrimaryKeyConstraint('id', name='PK_id'),
+        UniqueConstraint('minute', 'tid', 'step', 'endpoint', name='UK_minute_stage'),
+    )
+    id = Column(Integer)
+    minute = Column(TIMESTAMP, nullable=False, default='')
+    tid = Column(String(32), nullable=False, default='')
+    step = Column(Integer, nullable=False, default=0)
+    endpoint = Column(String(128), nullable=False, default='')
+    count = Column(Integer, nullable=False, default=0)
+    queue_p50 = Column(Integer, nullable=False, default=0)
+    queue_p90 = Column(Integer, nullable=False, default=0)
+    queue_p99 = Column(Integer, nullable=False, default=0)
+    queue_max = Column(Integer, nullable=False, default=0)
+    work_p50 = Column(Integer, nullable=False, default=0)
+    work_p90 = Column(Integer, nullable=False, default=0)
+    work_p99 = Column(Integer, nullable=False, default=0)
+    work_max = Column(Integer, nullable=False, default=0)
+    queue_hist = Column(TEXT, nullable=False)
+    work_hist = Column(TEXT, nullable=False)
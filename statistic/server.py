@@ -3,12 +3,12 @@ import zlib
 import time
 import asyncio
 import aiohttp
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import and_
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.dialects.mysql import insert
 from datetime import datetime
 import pipeflow
-from .models import AMZTaskStatistic
+from .models import AMZTaskStatistic, AMZStageLatency
+from .histogram import LatencyHistogram
 from util.log import logger
 from util.task_protocal import TaskProtocal
 from pipeflow import RabbitmqInputEndpoint, RabbitmqOutputEndpoint
@@ -24,7 +24,13 @@ TID_MAP = {
     ('4', 0): 'keyword_task',
 }
 last_flush_time = time.time()
+# (name, day) -> count, swapped for an empty one by each flush
 data_dct = {}
+# (tid, step, endpoint) -> (queue, work) histograms of stage_minute
+stage_dct = {}
+stage_minute = None
+# rows of the finished minutes, kept until written
+stage_row_ls = []
 
 
 DB_USER_NAME = STATS_DB_USER_NAME
@@ -52,66 +58,144 @@ engine = create_engine(SQLALCHEMY_DATABASE_URI,
     max_overflow=SQLALCHEMY_POOL_MAX_OVERFLOW,
     pool_recycle=SQLALCHEMY_POOL_RECYCLE,
 )
-db_session_mk = sessionmaker(bind=engine)
+stats_table = AMZTaskStatistic.__table__
+stage_table = AMZStageLatency.__table__
 
 
-def flush_data():
+def check_unique_key(table, column_ls):
+    """The upserts silently insert duplicate rows without their unique key,
+    refuse to start instead, see statistic/migration.sql
+    """
+    inspector = inspect(engine)
+    key_ls = [index['column_names'] for index in inspector.get_indexes(table.name) if index['unique']]
+    key_ls += [constraint['column_names'] for constraint in inspector.get_unique_constraints(table.name)]
+    if sorted(column_ls) not in [sorted(key) for key in key_ls]:
+        raise RuntimeError("%s needs a unique key on (%s), see statistic/migration.sql"
+                           % (table.name, ', '.join(column_ls)))
+
+
+def write_counts(flush_dct):
+    """Add the counts to their rows in one statement, needs the unique key (name, time)
+    """
+    stmt = insert(stats_table).values([{'name': name, 'time': day, 'count': count}
+                                       for (name, day), count in flush_dct.items()])
+    stmt = stmt.on_duplicate_key_update(count=stats_table.c.count + stmt.inserted.count)
+    with engine.begin() as conn:
+        conn.execute(stmt)
+
+
+async def flush_data(loop):
+    """Write the counts in the executor, the handle keeps counting in a new dict
+
+    The counts of a failed flush are merged back, so the next one retries them.
+    """
     global last_flush_time
-    db_session = db_session_mk()
-    time_now = datetime.now().strftime("%Y-%m-%d 00:00:00")
-    add_ls = []
-    for name in data_dct:
-        record = db_session.query(AMZTaskStatistic)\
-                .filter(and_(AMZTaskStatistic.name==name, AMZTaskStatistic.time==time_now))\
-                .first()
-        if not record:
-            amz_stats = AMZTaskStatistic()
-            amz_stats.name = name
-            amz_stats.count = data_dct[name]
-            amz_stats.time = time_now
-            add_ls.append(amz_stats)
-        else:
-            record.count += data_dct[name]
-    if add_ls:
-        db_session.bulk_save_objects(add_ls)
+    global data_dct
+    flush_dct, data_dct = data_dct, {}
     try:
-        db_session.commit()
-    except:
-        logger.error("flush db error")
-        db_session.rollback()
+        await loop.run_in_executor(None, write_counts, flush_dct)
+    except Exception as exc:
+        logger.error("flush db error: %s" % exc)
+        for key, count in flush_dct.items():
+            data_dct[key] = data_dct.get(key, 0) + count
     else:
         last_flush_time = time.time()
-    finally:
-        data_dct.clear()
-        db_session.close()
 
 
 async def auto_flush(server):
+    loop = server.get_event_loop()
     while True:
         time_now = time.time()
         if data_dct and time_now > last_flush_time + FLUSH_INTERVAL:
-            flush_data()
+            await flush_data(loop)
         await asyncio.sleep(FLUSH_INTERVAL)
 
 
+def close_stage_minute():
+    """Turn the histograms of stage_minute into rows"""
+    global stage_dct
+    for (tid, step, endpoint), (queue_hist, work_hist) in stage_dct.items():
+        stage_row_ls.append({
+            'minute': stage_minute, 'tid': tid, 'step': step, 'endpoint': endpoint,
+            'count': work_hist.count,
+            'queue_p50': queue_hist.percentile(50), 'queue_p90': queue_hist.percentile(90),
+            'queue_p99': queue_hist.percentile(99), 'queue_max': queue_hist.max,
+            'work_p50': work_hist.percentile(50), 'work_p90': work_hist.percentile(90),
+            'work_p99': work_hist.percentile(99), 'work_max': work_hist.max,
+            'queue_hist': json.dumps(queue_hist.count_map), 'work_hist': json.dumps(work_hist.count_map),
+        })
+    stage_dct = {}
+
+
+def write_stage_rows(row_ls):
+    """Rows are complete, a retried write just overwrites them"""
+    stmt = insert(stage_table).values(row_ls)
+    stmt = stmt.on_duplicate_key_update(**dict([(k, stmt.inserted[k]) for k in row_ls[0]
+                                                if k not in ('minute', 'tid', 'step', 'endpoint')]))
+    with engine.begin() as conn:
+        conn.execute(stmt)
+
+
+async def auto_flush_stage(server):
+    """Write the latencies of each minute once it is over"""
+    global stage_row_ls
+    loop = server.get_event_loop()
+    while True:
+        await asyncio.sleep(60 - time.time() % 60 + 1)
+        if stage_dct and stage_minute != datetime.now().strftime("%Y-%m-%d %H:%M:00"):
+            close_stage_minute()
+        if not stage_row_ls:
+            continue
+        row_ls, stage_row_ls = stage_row_ls, []
+        try:
+            await loop.run_in_executor(None, write_stage_rows, row_ls)
+        except Exception as exc:
+            logger.error("flush stage latency error: %s" % exc)
+            stage_row_ls = row_ls + stage_row_ls
+
+
+def record_hops(hop_ls):
+    """hop_ls is [[tid, step, endpoint, queue_ms, work_ms]], reported by flow_core"""
+    global stage_minute
+    minute = datetime.now().strftime("%Y-%m-%d %H:%M:00")
+    if minute != stage_minute:
+        if stage_dct:
+            close_stage_minute()
+        stage_minute = minute
+    for tid, step, endpoint, queue_ms, work_ms in hop_ls:
+        key = (tid, step, endpoint)
+        hist_pair = stage_dct.get(key)
+        if hist_pair is None:
+            hist_pair = stage_dct[key] = (LatencyHistogram(), LatencyHistogram())
+        hist_pair[0].record(queue_ms)
+        hist_pair[1].record(work_ms)
+
+
 async def handle_worker(group, task):
     """Handle statistic task
     """
     tp = TaskProtocal(task)
     task_dct = tp.get_data()
+    if 'hops' in task_dct:
+        record_hops(task_dct['hops'])
     if 'extra' in task_dct and 'stats' in task_dct['extra']:
         tid = task_dct['extra']['stats'].get('tid')
         step = task_dct['extra']['stats'].get('step')
+        # bulk inputs send one message for a batch of tasks
+        count = task_dct['extra']['stats'].get('count', 1)
         if (tid, step) in TID_MAP:
-            stats_name = TID_MAP[(tid, step)]
-            data_dct.setdefault(stats_name, 0)
-            data_dct[stats_name] += 1
+            # counted in the day they came in, even if flushed or retried later
+            key = (TID_MAP[(tid, step)], datetime.now().strftime("%Y-%m-%d 00:00:00"))
+            data_dct[key] = data_dct.get(key, 0) + count
 
 
 def run():
+    check_unique_key(stats_table, ['name', 'time'])
+    check_unique_key(stage_table, ['minute', 'tid', 'step', 'endpoint'])
     input_end = RabbitmqInputEndpoint('statistic:input', **RABBITMQ_CONF)
     server = pipeflow.Server()
     server.add_worker(auto_flush)
+    server.add_worker(auto_flush_stage)
     group = server.add_group('main', MAX_WORKERS)
     group.add_input_endpoint('input', input_end)
     group.set_handle(handle_worker)
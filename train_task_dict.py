@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""Train the zstd dictionary of task format 2 on sample payloads.
+
+Samples are json lines, either whole tasks ({"tid": .., "i": .., "data": ..})
+or just their data, e.g. dumped from the product, review and keyword queues.
+Add the output file at the head of TASK_ZSTD_DICT_LS in config.py.
+"""
+import json
+import argparse
+import msgpack
+import zstandard
+
+
+def load_samples(path_ls):
+    sample_ls = []
+    for path in path_ls:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                dct = json.loads(line)
+                if 'data' in dct and 'tid' in dct:
+                    dct = dct['data']
+                sample_ls.append(msgpack.packb(dct, use_bin_type=True))
+    return sample_ls
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train zstd dictionary for task payloads')
+    parser.add_argument('-o', '--output', dest='output', required=True, help='dictionary file')
+    parser.add_argument('-s', '--size', dest='size', type=int, default=112640,
+                        help='dictionary size in bytes')
+    parser.add_argument('samples', nargs='+', help='json lines sample files')
+    args = parser.parse_args()
+
+    sample_ls = load_samples(args.samples)
+    dict_data = zstandard.train_dictionary(args.size, sample_ls)
+    with open(args.output, 'wb') as f:
+        f.write(dict_data.as_bytes())
+    print("samples: %d, dict id: %d, size: %d" % (len(sample_ls), dict_data.dict_id(), len(dict_data)))
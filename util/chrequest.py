@@ -1,8 +1,10 @@
 import os
+import time
 import subprocess
 import asyncio
 import aiohttp
 import concurrent.futures
+from lxml import etree
 from error import RequestError, StatusError
 from .headers import get_header
 from .log import logger
@@ -19,6 +21,58 @@ event_wait = 0
 in_request = 0
 change_ip_cnt = 0
 
+CONN_LIMIT = 100
+CONN_LIMIT_PER_HOST = 10
+KEEPALIVE_TIMEOUT = 30
+DNS_CACHE_TTL = 300
+
+
+class SessionManager:
+    """Share one ClientSession between all requests of the process.
+
+    Its connector keeps connections alive and caches DNS, so requests to the
+    same host skip the TCP and TLS handshakes. It must be closed when the
+    machine IP changes, sockets bound to the old address are useless.
+    limit_per_host should be the number of workers of the process, or the
+    workers beyond it queue for a connection to the same host.
+    It has no cookie jar, so cookies don't leak between requests, but the
+    cookies set by a redirect aren't sent to its target either.
+    """
+    def __init__(self, limit=CONN_LIMIT, limit_per_host=CONN_LIMIT_PER_HOST,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, ttl_dns_cache=DNS_CACHE_TTL):
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._ttl_dns_cache = ttl_dns_cache
+        self._session = None
+
+    def set_limits(self, limit=None, limit_per_host=None):
+        """Change the connection limits, before the session is created"""
+        assert self._session is None, "session already created"
+        if limit is not None:
+            self._limit = limit
+        if limit_per_host is not None:
+            self._limit_per_host = limit_per_host
+
+    def get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._limit, limit_per_host=self._limit_per_host,
+                                             keepalive_timeout=self._keepalive_timeout,
+                                             use_dns_cache=True, ttl_dns_cache=self._ttl_dns_cache)
+            # no cookie jar, cookies of a request (captcha ones included) must
+            # not be sent with the next ones, as with a session per request
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  cookie_jar=aiohttp.DummyCookieJar())
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+
+session_manager = SessionManager()
+
 
 def is_captcha_page(soup):
     if soup.xpath('//*[contains(@action, "validateCaptcha")]'):
@@ -50,13 +104,15 @@ async def get_page(url, timeout=60, encoding="utf-8"):
             headers = get_header()
             html = None
             try:
-                async with aiohttp.ClientSession(headers=headers) as session:
-                    async with session.get(url, timeout=timeout) as resp:
-                        html = await resp.read()
-                        if resp.status != 200:
-                            logger.error('[%d] %s' % (resp.status, url))
-                            raise StatusError(resp.status)
-                        soup = etree.HTML(html, parser=etree.HTMLParser(encoding=encoding))
+                session = session_manager.get_session()
+                start_time = time.time()
+                async with session.get(url, headers=headers, timeout=timeout) as resp:
+                    html = await resp.read()
+                    logger.debug('[%d] %s %.0fms' % (resp.status, url, (time.time()-start_time)*1000))
+                    if resp.status != 200:
+                        logger.error('[%d] %s' % (resp.status, url))
+                        raise StatusError(resp.status)
+                    soup = etree.HTML(html, parser=etree.HTMLParser(encoding=encoding))
             except StatusError:
                 raise
             #except Exception as exc:
@@ -115,6 +171,8 @@ async def change_ip(server):
         assert event_wait, "event_wait should more than 0"
         assert event_wait==in_request, "event_wait should be equal to running_cnt"
         logger.info("[%d]change ip start" % change_ip_cnt)
+        # no request is running now, drop the connections of the old ip
+        await session_manager.close()
         while True:
             future = loop.run_in_executor(executor, execute, 'ifdown ppp0')
             ret = await future
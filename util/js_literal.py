@@ -0,0 +1,183 @@
+import re
+
+
+# One token per match; whitespace and comments are skipped as a single token.
+TOKEN_RE = re.compile(r'''
+    (?P<ws>(?:\s+|//[^\n]*|/\*.*?\*/)+)
+  | (?P<str>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<num>-?(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?))
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<punct>[{}\[\]():,])
+  | (?P<other>\S)
+''', re.S | re.X)
+ESCAPE_RE = re.compile(r'\\(x[0-9a-fA-F]{2}|u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|\r\n|.)', re.S)
+ESCAPE_MAP = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v', '0': '\0',
+              '\n': '', '\r': '', '\r\n': '', '\u2028': '', '\u2029': ''}
+NAME_MAP = {'true': True, 'false': False, 'null': None, 'undefined': None,
+            'NaN': float('nan'), 'Infinity': float('inf')}
+
+
+def _unescape_char(match):
+    esc = match.group(1)
+    if esc[0] == 'x':
+        return chr(int(esc[1:], 16))
+    if esc[0] == 'u' and len(esc) > 1:
+        return chr(int(esc[1:].strip('{}'), 16))
+    return ESCAPE_MAP.get(esc, esc)
+
+
+def _decode_string(token):
+    text = token[1:-1]
+    if '\\' not in text:
+        return text
+    text = ESCAPE_RE.sub(_unescape_char, text)
+    try:
+        text.encode('utf-8')
+    except UnicodeEncodeError:
+        # join surrogate pairs written as two \uXXXX escapes
+        text = text.encode('utf-16', 'surrogatepass').decode('utf-16')
+    return text
+
+
+def _decode_number(token):
+    body = token.lstrip('-')
+    if body[:2] in ('0x', '0X'):
+        value = int(body, 16)
+    elif '.' in body or 'e' in body or 'E' in body:
+        value = float(body)
+    else:
+        value = int(body)
+    return -value if token[0] == '-' else value
+
+
+class JSLiteralParser:
+    """Turn a javascript object/array literal into python objects.
+
+    Accepts what JSON.parse would refuse but page scripts are full of:
+    single quoted strings, unquoted keys, trailing commas and comments.
+    Anything that needs a javascript engine (function calls, variable
+    references, arithmetic) is skipped and decoded as None.
+    """
+    def __init__(self, text, pos=0):
+        self.text = text
+        self.pos = pos
+
+    def next_token(self):
+        while True:
+            match = TOKEN_RE.match(self.text, self.pos)
+            if match is None:
+                raise ValueError("Unexpected end of javascript literal at %d" % self.pos)
+            self.pos = match.end()
+            if match.lastgroup != 'ws':
+                return match.lastgroup, match.group()
+
+    def peek_token(self):
+        pos = self.pos
+        token = self.next_token()
+        self.pos = pos
+        return token
+
+    def error(self, token):
+        return ValueError("Unexpected token %r at %d" % (token, self.pos))
+
+    def parse_value(self, kind=None, token=None):
+        if kind is None:
+            kind, token = self.next_token()
+        if token == '{':
+            return self.parse_object()
+        if token == '[':
+            return self.parse_array()
+        if kind == 'str':
+            return self.finish_expression(_decode_string(token))
+        if kind == 'num':
+            return self.finish_expression(_decode_number(token))
+        if kind == 'name' and token in NAME_MAP:
+            return self.finish_expression(NAME_MAP[token])
+        if kind in ('name', 'other') or token == '(':
+            self.skip_expression(token)
+            return None
+        raise self.error(token)
+
+    def finish_expression(self, value):
+        """Return value if the literal ends here, None if it is part of an expression"""
+        kind, token = self.peek_token()
+        if token in (',', '}', ']') or kind == 'other' and token == ';':
+            return value
+        self.skip_expression(token)
+        return None
+
+    def skip_expression(self, token):
+        depth = 1 if token in ('{', '[', '(') else 0
+        while True:
+            pos = self.pos
+            kind, token = self.next_token()
+            if token in ('{', '[', '('):
+                depth += 1
+            elif token in ('}', ']', ')'):
+                if depth == 0:
+                    self.pos = pos
+                    return
+                depth -= 1
+            elif depth == 0 and (token == ',' or kind == 'other' and token == ';'):
+                self.pos = pos
+                return
+
+    def parse_object(self):
+        obj = {}
+        while True:
+            kind, token = self.next_token()
+            if token == '}':
+                return obj
+            if kind == 'str':
+                key = _decode_string(token)
+            elif kind in ('name', 'num'):
+                key = token
+            else:
+                raise self.error(token)
+            kind, token = self.next_token()
+            if token != ':':
+                raise self.error(token)
+            obj[key] = self.parse_value()
+            kind, token = self.next_token()
+            if token == '}':
+                return obj
+            if token != ',':
+                raise self.error(token)
+
+    def parse_array(self):
+        arr = []
+        while True:
+            kind, token = self.next_token()
+            if token == ']':
+                return arr
+            if token == ',':
+                # elision, e.g. [1,,2]
+                arr.append(None)
+                continue
+            arr.append(self.parse_value(kind, token))
+            kind, token = self.next_token()
+            if token == ']':
+                return arr
+            if token != ',':
+                raise self.error(token)
+
+
+def raw_decode(text, pos=0):
+    """Decode the literal starting at text[pos], return (value, end)"""
+    parser = JSLiteralParser(text, pos)
+    kind, token = parser.next_token()
+    if token == '{':
+        value = parser.parse_object()
+    elif token == '[':
+        value = parser.parse_array()
+    else:
+        value = parser.parse_value(kind, token)
+    return value, parser.pos
+
+
+def loads(text):
+    """Decode a javascript literal"""
+    value, end = raw_decode(text)
+    if text[end:].strip().rstrip(';').strip():
+        raise ValueError("Extra data at %d" % end)
+    return value
@@ -0,0 +1,60 @@
+import asyncio
+import functools
+import importlib
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from .log import logger
+
+
+def preload(module_ls):
+    """Import spider modules once when a worker process starts"""
+    for name in module_ls:
+        importlib.import_module(name)
+
+
+def ready(_):
+    return True
+
+
+class ParseExecutor:
+    """Run page parsing inline or in a pool of worker processes.
+
+    Inline (the default), func runs on the event loop like before.
+    With workers, the raw html goes to a child process which builds the soup
+    and runs the spider there, and only the extracted result comes back, so
+    func and its arguments/result must be picklable.
+    """
+    def __init__(self, preload_ls=()):
+        self._preload_ls = list(preload_ls)
+        self._workers = 0
+        self._executor = None
+
+    def _create_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(
+                self._workers, initializer=preload, initargs=(self._preload_ls,))
+
+    def start(self, workers):
+        self._workers = workers
+        if workers <= 0:
+            return
+        self._executor = self._create_executor()
+        # make the pool fork at the beginning, before any connection is opened
+        list(self._executor.map(ready, range(workers)))
+        logger.info("parse executor started with %d workers" % workers)
+
+    async def run(self, func, *args):
+        if self._executor is None:
+            return func(*args)
+        loop = asyncio.get_event_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, functools.partial(func, *args))
+        except BrokenProcessPool:
+            # a worker died, every pending call fails with it, restart only once
+            if executor is self._executor:
+                logger.error("parse executor broken, restart it")
+                # don't block the loop: the dead pool is reaped in the background
+                # and the new one forks its workers as calls come in
+                executor.shutdown(wait=False)
+                self._executor = self._create_executor()
+            raise
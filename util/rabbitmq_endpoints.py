@@ -20,9 +20,16 @@ def ack(message):
 
 
 class RabbitmqInputEndpoint(RabbitMQClient, AbstractCoroutineInputEndpoint):
-    """Rabbitmq aio input endpoint"""
+    """Rabbitmq aio input endpoint
 
-    def __init__(self, queue_name, loop=None, no_ack=False, qos=1, **conf):
+    Messages are handed over to get() one at a time, unless buffered is set,
+    then up to qos delivered messages wait in a buffer so the consumer is not
+    held by the slowest handler.
+    With no_ack, a message is acked when its task is confirmed, otherwise
+    when it enters the buffer.
+    """
+
+    def __init__(self, queue_name, loop=None, no_ack=False, qos=1, buffered=False, **conf):
         self._loop = loop
         self._no_ack = no_ack
         self._qos = qos
@@ -31,7 +38,7 @@ class RabbitmqInputEndpoint(RabbitMQClient, AbstractCoroutineInputEndpoint):
         if queue_name is None:
             raise ValueError("queue_name must be not None")
         self._queue_name = queue_name
-        self._inner_q = asyncio.Queue(1)
+        self._inner_q = asyncio.Queue(qos if buffered else 1)
         super(RabbitmqInputEndpoint, self).__init__(**conf)
         self._loop.run_until_complete(self.initialize())
 
@@ -51,6 +58,17 @@ class RabbitmqInputEndpoint(RabbitMQClient, AbstractCoroutineInputEndpoint):
 
     async def get(self):
         message = await self._inner_q.get()
+        return self._to_task(message)
+
+    async def get_many(self, max_count=None):
+        """Wait for one task, then take whatever is already buffered, up to max_count tasks
+        """
+        message_ls = [await self._inner_q.get()]
+        while not self._inner_q.empty() and (max_count is None or len(message_ls) < max_count):
+            message_ls.append(self._inner_q.get_nowait())
+        return [self._to_task(message) for message in message_ls]
+
+    def _to_task(self, message):
         task = Task(message.body)
         if self._no_ack:
             task.set_confirm_handle(functools.partial(ack, message))
@@ -63,16 +81,25 @@ class RabbitmqInputEndpoint(RabbitMQClient, AbstractCoroutineInputEndpoint):
 
 
 class RabbitmqOutputEndpoint(RabbitMQClient, AbstractCoroutineOutputEndpoint):
-    """Rabbitmq aio output endpoint"""
+    """Rabbitmq aio output endpoint
+
+    In batch mode the tasks of one put are published concurrently, at most
+    max_inflight of them waiting for a publisher confirm at a time, and each
+    task is confirmed as soon as its own confirm arrives.
+    """
 
-    def __init__(self, queue_name, persistent=False, loop=None, **conf):
+    def __init__(self, queue_name, persistent=False, loop=None, batch=False, max_inflight=100, **conf):
         self._loop = loop
         if self._loop is None:
             self._loop = asyncio.get_event_loop()
         if queue_name is None:
             raise ValueError("queue_name must be not None")
+        if max_inflight < 1:
+            raise ValueError("max_inflight must be positive")
         self._queue_name = queue_name
         self._persistent = persistent
+        self._batch = batch
+        self._inflight = asyncio.Semaphore(max_inflight)
         super(RabbitmqOutputEndpoint, self).__init__(**conf)
         self._loop.run_until_complete(self.initialize())
 
@@ -95,11 +122,21 @@ class RabbitmqOutputEndpoint(RabbitMQClient, AbstractCoroutineOutputEndpoint):
     async def _put(self, queue_name, tasks):
         """Put a message into a list
         """
-        for task in tasks:
-            if self._persistent:
-                message = aio_pika.Message(task.get_raw_data(), delivery_mode=aio_pika.DeliveryMode.PERSISTENT)
-            else:
-                message = aio_pika.Message(task.get_raw_data())
+        if not self._batch:
+            for task in tasks:
+                await self._publish(task)
+            return
+        ret_ls = await asyncio.gather(*[self._publish(task) for task in tasks], return_exceptions=True)
+        for ret in ret_ls:
+            if isinstance(ret, Exception):
+                raise ret
+
+    async def _publish(self, task):
+        if self._persistent:
+            message = aio_pika.Message(task.get_raw_data(), delivery_mode=aio_pika.DeliveryMode.PERSISTENT)
+        else:
+            message = aio_pika.Message(task.get_raw_data())
+        async with self._inflight:
             ret = await self._channel.default_exchange.publish(message, routing_key=self._queue_name)
-            if ret:
-                task.confirm()
+        if ret:
+            task.confirm()
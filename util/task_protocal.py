@@ -1,44 +1,353 @@
 import json
 import zlib
 import copy
+import time
+import struct
 from pipeflow import Task
+from config import TASK_FORMAT, TASK_QUEUE_FORMAT, TASK_ZSTD_DICT_LS
+try:
+    import msgpack
+    import zstandard
+except ImportError:
+    msgpack = None
+    zstandard = None
+
+
+HEADER_LEN = struct.Struct('>H')
+# hops a task carries at most between two passes in flow_core
+MAX_HOPS = 8
+
+_UNKNOWN = object()
+
+
+class Envelope:
+    """Version byte, header length, header, compressed body.
+
+    The header carries everything but 'data' (tid, step, ...), so routing a
+    task never inflates its body. Legacy tasks are a zlib compressed json of
+    the whole dict, they start with a zlib header and never with a version byte.
+    """
+    version = None
+
+    def dump_header(self, header):
+        raise NotImplementedError
+
+    def load_header(self, raw):
+        raise NotImplementedError
+
+    def encode_body(self, data):
+        raise NotImplementedError
+
+    def decode_body(self, body):
+        raise NotImplementedError
+
+    def pack(self, header, body):
+        header_raw = self.dump_header(header)
+        return self.version + HEADER_LEN.pack(len(header_raw)) + header_raw + body
+
+    def unpack_header(self, raw):
+        """Split an envelope into its header and the still compressed body
+        """
+        start = len(self.version) + HEADER_LEN.size
+        header_len, = HEADER_LEN.unpack_from(raw, len(self.version))
+        return self.load_header(raw[start:start+header_len]), raw[start+header_len:]
+
+
+class JSONEnvelope(Envelope):
+    """v1: json header, zlib compressed json body"""
+    version = b'\x01'
+
+    def dump_header(self, header):
+        return json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    def load_header(self, raw):
+        return json.loads(raw.decode('utf-8'))
+
+    def encode_body(self, data):
+        return zlib.compress(json.dumps(data).encode('utf-8'))
+
+    def decode_body(self, body):
+        return json.loads(zlib.decompress(body).decode('utf-8'))
+
+
+def json_keys(obj):
+    """obj with the dict keys turned into strings the way json does, so a
+    msgpack body decodes to the same data as a json one
+    """
+    if isinstance(obj, dict):
+        return dict([(k if isinstance(k, str) else json_key(k), json_keys(v)) for k, v in obj.items()])
+    if isinstance(obj, (list, tuple)):
+        return [json_keys(v) for v in obj]
+    return obj
+
+
+def json_key(key):
+    if key is None or isinstance(key, (bool, int, float)):
+        return json.dumps(key)
+    raise TypeError("keys must be str, int, float, bool or None, not %s" % type(key).__name__)
+
+
+class MsgpackEnvelope(Envelope):
+    """v2: msgpack header, zstd compressed msgpack body
+
+    Bodies are compressed with the first dictionary of dict_path_ls, all of
+    them are loaded to decompress bodies compressed with an older dictionary.
+    Dict keys are written as strings, like json, so every format gives back
+    the same data.
+    """
+    version = b'\x02'
+
+    def __init__(self, dict_path_ls=()):
+        if msgpack is None or zstandard is None:
+            raise RuntimeError("msgpack and zstandard are required by task format 2")
+        dict_ls = []
+        for path in dict_path_ls:
+            with open(path, 'rb') as f:
+                dict_ls.append(zstandard.ZstdCompressionDict(f.read()))
+        if dict_ls:
+            self._compressor = zstandard.ZstdCompressor(dict_data=dict_ls[0])
+        else:
+            self._compressor = zstandard.ZstdCompressor()
+        self._decompressor_map = {0: zstandard.ZstdDecompressor()}
+        for dict_data in dict_ls:
+            self._decompressor_map[dict_data.dict_id()] = zstandard.ZstdDecompressor(dict_data=dict_data)
+
+    def dump_header(self, header):
+        return msgpack.packb(header, use_bin_type=True)
+
+    def load_header(self, raw):
+        return msgpack.unpackb(raw, raw=False)
+
+    def encode_body(self, data):
+        return self._compressor.compress(msgpack.packb(json_keys(data), use_bin_type=True))
+
+    def decode_body(self, body):
+        dict_id = zstandard.get_frame_parameters(body).dict_id
+        if dict_id not in self._decompressor_map:
+            raise ValueError("zstd dictionary %d isn't loaded" % dict_id)
+        return msgpack.unpackb(self._decompressor_map[dict_id].decompress(body),
+                               raw=False, strict_map_key=False)
+
+
+ENVELOPE_CLS_MAP = {
+    JSONEnvelope.version: JSONEnvelope,
+    MsgpackEnvelope.version: MsgpackEnvelope,
+}
+envelope_map = {}
+
+
+def get_envelope(version):
+    """Return the envelope of a version byte, None for a legacy task
+    """
+    if version not in ENVELOPE_CLS_MAP:
+        return None
+    if version not in envelope_map:
+        if version == MsgpackEnvelope.version:
+            envelope_map[version] = MsgpackEnvelope(TASK_ZSTD_DICT_LS)
+        else:
+            envelope_map[version] = ENVELOPE_CLS_MAP[version]()
+    return envelope_map[version]
+
+
+# envelope of the tasks we write, None writes the legacy format
+WRITE_ENVELOPE = get_envelope(bytes([TASK_FORMAT])) if TASK_FORMAT else None
+# envelope of the outputs with their own format
+QUEUE_ENVELOPE_MAP = dict([(name, get_envelope(bytes([fmt])) if fmt else None)
+                           for name, fmt in TASK_QUEUE_FORMAT.items()])
+
+
+def now_ms():
+    return int(time.time()*1000)
 
 
 class TaskProtocal(Task):
-    __slots__ = ['_info']
+    """Task of the flow, 'tid' and step 'i' in the header, the task dict in 'data'
+
+    Once flow_core has stamped a task, its header also has 'ts':
+    [base, [endpoint, step, recv, send], ...], the epoch ms it left flow_core
+    and a hop for each process it went through since, the ms it was received
+    on endpoint and the ms its next task was sent, relative to base.
+
+    A task is written in TASK_FORMAT, unless it is sent to an output of
+    TASK_QUEUE_FORMAT, then set_to rewrites it in the format of the output.
+    """
+    __slots__ = ['_header', '_envelope', '_body', '_body_map', '_info', '_extra', '_recv_ms']
     def __init__(self, task):
         assert isinstance(task, (Task, dict)), "task should be a instance of Task or dict"
+        self._extra = _UNKNOWN
+        self._recv_ms = None
+        self._body_map = None
         if isinstance(task, Task):
+            self._recv_ms = now_ms()
             _data = task.get_raw_data()
             super(TaskProtocal, self).__init__(_data)
             self.set_from(task.get_from())
-            self.set_to(task.get_to())
+            Task.set_to(self, task.get_to())
             self.set_confirm_handle(task.get_confirm_handle())
-            self._info = json.loads(zlib.decompress(_data).decode('utf-8'))
+            self._envelope = get_envelope(_data[:1])
+            if self._envelope is not None:
+                self._header, self._body = self._envelope.unpack_header(_data)
+                self._info = None
+            else:
+                info = json.loads(zlib.decompress(_data).decode('utf-8'))
+                self._info = info.pop('data', None)
+                self._header = info
+                self._body = None
+        else:
+            self._header = dict([(k, v) for k, v in task.items() if k != 'data'])
+            self._info = None
+            self._envelope = WRITE_ENVELOPE
+            if self._envelope is None:
+                self._body = None
+                super(TaskProtocal, self).__init__(zlib.compress(json.dumps(task).encode('utf-8')))
+            else:
+                self._body = self._envelope.encode_body(task['data'])
+                super(TaskProtocal, self).__init__(self._envelope.pack(self._header, self._body))
+        assert 'i' in self._header and 'tid' in self._header, "Task Protocal illegal"
+
+    def _decode(self):
+        if self._envelope is None:
+            return json.loads(zlib.decompress(self.get_raw_data()).decode('utf-8'))['data']
+        return self._envelope.decode_body(self._body)
+
+    def set_to(self, name):
+        envelope = QUEUE_ENVELOPE_MAP.get(name, self._envelope)
+        if envelope is not self._envelope:
+            self._repack(envelope)
+        super(TaskProtocal, self).set_to(name)
+
+    def _repack(self, envelope):
+        """Rewrite the task in the format of envelope, None for the legacy one"""
+        data = self._info if self._info is not None else self._decode()
+        if envelope is None:
+            dct = dict(self._header)
+            dct['data'] = data
+            body = None
+            raw = zlib.compress(json.dumps(dct).encode('utf-8'))
         else:
-            super(TaskProtocal, self).__init__(zlib.compress(json.dumps(task).encode('utf-8')))
-            self._info = task
-        assert 'i' in self._info and 'tid' in self._info, "Task Protocal illegal"
+            body = self._get_body(envelope)
+            raw = envelope.pack(self._header, body)
+        from_name, confirm_handle = self.get_from(), self.get_confirm_handle()
+        Task.__init__(self, raw)
+        self.set_from(from_name)
+        self.set_confirm_handle(confirm_handle)
+        self._envelope = envelope
+        self._body = body
 
     def get_data(self):
-        return copy.deepcopy(self._info['data'])
+        """Decode the body, every call returns a new object the caller may modify
+        """
+        if self._info is not None:
+            data, self._info = self._info, None
+        else:
+            data = self._decode()
+        if self._extra is _UNKNOWN:
+            self._extra = copy.deepcopy(data['extra']) if 'extra' in data else None
+        return data
+
+    def _get_extra(self):
+        if self._extra is _UNKNOWN:
+            data = self._info if self._info is not None else self._decode()
+            self._extra = copy.deepcopy(data['extra']) if 'extra' in data else None
+        return self._extra
+
+    def get_header(self):
+        return self._header
 
     def get_tid(self):
-        return self._info['tid']
+        return self._header['tid']
 
     def get_step(self):
-        return self._info['i']
+        return self._header['i']
+
+    def get_hops(self):
+        """[(endpoint, step, queue_ms, work_ms)] of the hops since flow_core, this one included
 
-    def new_task(self, data, tid=None, next_step=False):
+        queue_ms is the time from the previous hop sending the task to this one
+        receiving it, work_ms the time from receiving it to sending the next task.
+        """
+        ts = self._header.get('ts')
+        if not ts or self._recv_ms is None:
+            return []
+        base = ts[0]
+        hop_ls = ts[1:] + [[self.get_from(), self._header['i'], self._recv_ms-base, now_ms()-base]]
+        ret_ls = []
+        prev_send = 0
+        for endpoint, step, recv, send in hop_ls:
+            ret_ls.append((endpoint, step, max(recv-prev_send, 0), max(send-recv, 0)))
+            prev_send = send
+        return ret_ls
+
+    def _next_ts(self, reset_hops):
+        if reset_hops:
+            return [now_ms()]
+        ts = self._header.get('ts')
+        if not ts or self._recv_ms is None or len(ts) > MAX_HOPS:
+            return ts
+        base = ts[0]
+        return ts + [[self.get_from(), self._header['i'], self._recv_ms-base, now_ms()-base]]
+
+    def new_task(self, data, tid=None, next_step=False, reset_hops=False):
         assert isinstance(data, dict), "data isn't a dict"
-        if 'extra' in self._info['data']:
+        extra = self._get_extra()
+        if extra is not None:
             dct = data.setdefault("extra", {})
-            dct.update(self._info['data']['extra'])
+            dct.update(extra)
         dct = {
-            'tid': tid if tid else self._info['tid'],
-            'i': 0 if tid else self._info['i']+1 if next_step else self._info['i'],
+            'tid': tid if tid else self._header['tid'],
+            'i': 0 if tid else self._header['i']+1 if next_step else self._header['i'],
             'data': data
         }
+        ts = self._next_ts(reset_hops)
+        if ts:
+            dct['ts'] = ts
         tp = TaskProtocal(dct)
         tp.set_confirm_handle(self.get_confirm_handle())
         return tp
+
+    def _get_body(self, envelope):
+        """Body in the format of envelope, encoded once for all the tasks forwarded from this one"""
+        if envelope is self._envelope:
+            return self._body
+        if self._body_map is None:
+            self._body_map = {}
+        if envelope.version not in self._body_map:
+            data = self._info if self._info is not None else self._decode()
+            self._body_map[envelope.version] = envelope.encode_body(data)
+        return self._body_map[envelope.version]
+
+    def forward(self, tid=None, next_step=False, reset_hops=False, to=None):
+        """Same as new_task(self.get_data(), tid, next_step), without decoding the body
+
+        The task is written in the format of the output to (see set_to). For
+        an envelope format only the header is rewritten, the compressed body
+        is reused as it is, or converted once for all the forwarded tasks, so
+        forwarding a task to several queues doesn't compress it again.
+        With reset_hops the hops are dropped and timing starts over from now.
+        """
+        envelope = QUEUE_ENVELOPE_MAP.get(to, WRITE_ENVELOPE)
+        if envelope is None:
+            tp = self.new_task(self.get_data(), tid=tid, next_step=next_step, reset_hops=reset_hops)
+            if to is not None:
+                tp.set_to(to)
+            return tp
+        header = dict(self._header)
+        header['tid'] = tid if tid else self._header['tid']
+        header['i'] = 0 if tid else self._header['i']+1 if next_step else self._header['i']
+        ts = self._next_ts(reset_hops)
+        if ts:
+            header['ts'] = ts
+        body = self._get_body(envelope)
+        tp = TaskProtocal.__new__(TaskProtocal)
+        Task.__init__(tp, envelope.pack(header, body))
+        tp._header = header
+        tp._envelope = envelope
+        tp._body = body
+        tp._body_map = None
+        tp._info = None
+        tp._extra = _UNKNOWN
+        tp._recv_ms = None
+        tp.set_confirm_handle(self.get_confirm_handle())
+        if to is not None:
+            Task.set_to(tp, to)
+        return tp
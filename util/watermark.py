@@ -0,0 +1,53 @@
+import time
+import sqlite3
+from .log import logger
+
+
+class WatermarkStore:
+    """Newest item id crawled per (platform, asin), kept in a local sqlite file.
+
+    Crawlers use it as the default till of a task, and move it forward when
+    a crawl reaches its end, so a re-crawl stops at the first known item.
+    One table per kind (review, qa), the file may be shared by the services
+    of a host. An empty path disables the store.
+    """
+    def __init__(self, path, kind):
+        self._path = path
+        self._kind = kind
+        self._conn = None
+
+    def _get_conn(self):
+        if self._conn is None:
+            # opened on first use, after the parse workers are forked
+            self._conn = sqlite3.connect(self._path, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS %s_watermark ("
+                               "platform TEXT NOT NULL, asin TEXT NOT NULL, "
+                               "mark TEXT NOT NULL, update_time INTEGER NOT NULL, "
+                               "PRIMARY KEY (platform, asin))" % self._kind)
+            self._conn.commit()
+        return self._conn
+
+    def get(self, platform, asin):
+        if not self._path:
+            return None
+        try:
+            row = self._get_conn().execute(
+                    "SELECT mark FROM %s_watermark WHERE platform=? AND asin=?" % self._kind,
+                    (platform, asin)).fetchone()
+        except sqlite3.Error as exc:
+            logger.error("get watermark error: %s" % exc)
+            return None
+        return row[0] if row else None
+
+    def set(self, platform, asin, mark):
+        if not self._path or not mark:
+            return
+        try:
+            conn = self._get_conn()
+            conn.execute("INSERT OR REPLACE INTO %s_watermark (platform, asin, mark, update_time) "
+                         "VALUES (?, ?, ?, ?)" % self._kind,
+                         (platform, asin, mark, int(time.time())))
+            conn.commit()
+        except sqlite3.Error as exc:
+            logger.error("set watermark error: %s" % exc)